@@ -1,48 +1,287 @@
 import csv
+import multiprocessing
 import os
+import re
+from collections import defaultdict
+
+import numpy
 
 import corenlp
+from corenlp import store as corenlp_store
 
 import data
 
+annotation_re = re.compile(r'^(?P<year>\d+)_(?P<debate>\d+)_(?P<doc_id>\d+)'
+                           r'\.txt\.xml$')
+
+
+class CandidateMatcher(object):
+    '''
+    Index from lowercased lemma to the parties whose candidate names it
+    matches, built once per year from data.candidates. A multiword name
+    such as 'vice president' matches a mention head whose lemma is the
+    last word of the name when the tokens right before it in the sentence
+    carry the other words.
+    '''
+
+    def __init__(self, names_by_party):
+        self.single = defaultdict(set)
+        self.multi = defaultdict(list)
+        for party, names in names_by_party.items():
+            for name in names:
+                words = tuple(name.lower().split())
+                if len(words) == 1:
+                    self.single[words[0]].add(party)
+                else:
+                    self.multi[words[-1]].append((words[:-1], party))
+
+    def token_parties(self, token):
+        lem = token.lem.lower()
+        parties = self.single.get(lem, ())
+        prefixes = self.multi.get(lem)
+        if prefixes:
+            parties = set(parties)
+            tokens = token.sent.tokens
+            for prefix, party in prefixes:
+                start = token.idx - len(prefix)
+                if start >= 0 and prefix == tuple(t.lem.lower() for t in
+                                                  tokens[start:token.idx]):
+                    parties.add(party)
+        return parties
+
+    def chain_parties(self, chain):
+        '''
+        Parties any of whose names matches one of the chain's mention heads
+        '''
+        parties = set()
+        for t in chain.mention_heads:
+            parties.update(self.token_parties(t))
+        return parties
+
+
+_matchers = {}
+party_index = {party: i for i, party in enumerate(data.parties)}
+# Values of the party columns of hand annotation files that mark a mention
+hand_true_values = ['T', 'TRUE', 'True', 'X', 'x']
+
+
+def candidate_matcher(year):
+    if year not in _matchers:
+        _matchers[year] = CandidateMatcher(data.candidates[year])
+    return _matchers[year]
+
+
 class DocAnnotation(object):
 
-    def __init__(self, d, year, debate, doc_id):
+    def __init__(self, d, year, debate, doc_id, cache=False, store=None,
+                 doc=None, pack=None):
+        '''
+        d: directory of CoreNLP annotations.
+        cache: read and write the sidecar cache of the XML file (see
+        corenlp.Document), which writes into d.
+        store: optional corenlp.store.Store (see build_annotation_store) to
+        read the document from instead of its XML file.
+        doc: the corenlp.Document, if it has already been read (see
+        Corpus).
+        pack: optional corenlp.pack.PackReader of annotations to read the
+        XML from instead of d. Packed documents are not cached.
+        '''
         filename = '%s_%s_%03d.txt.xml' % (year, debate, doc_id)
-        self.doc = corenlp.Document(os.path.join(d, filename))
+        if doc is not None:
+            self.doc = doc
+        elif store is not None:
+            self.doc = store.document((year, debate, doc_id))
+        elif pack is not None:
+            self.doc = corenlp.Document(pack.open(filename))
+        else:
+            self.doc = corenlp.Document(os.path.join(d, filename),
+                                        cache=cache)
         self.year, self.debate, self.doc_id = year, debate, doc_id
         self.find_candidate_mentions()
 
     def find_candidate_mentions(self):
-        can = data.candidates[self.year]
-        self.candidate_mentions = {party: set() for party in data.parties}
+        '''
+        Fill self.mentions, a boolean matrix with one row per sentence
+        (indexed by Sentence.idx) and one column per party in data.parties,
+        which is True where the sentence mentions the party's candidate.
+        '''
+        matcher = candidate_matcher(self.year)
+        self.mentions = numpy.zeros((len(self.doc), len(data.parties)),
+                                    dtype=bool)
         for chain in self.doc.mention_chains:
-            for party, names in can.items():
-                if any(name.lower() == t.lem.lower()
-                       for t in chain.mention_heads
-                       for name in names):
-                    for t in chain.mention_heads:
-                        self.candidate_mentions[party].add(t.sent)
-
-    def sentences_csv_file(self, output_file, empty=False):
+            parties = matcher.chain_parties(chain)
+            if parties:
+                rows = [t.sent.idx for t in chain.mention_heads]
+                for party in parties:
+                    self.mentions[rows, party_index[party]] = True
+
+    def party_mentions(self, parties):
+        '''
+        Columns of self.mentions for the given parties, in that order
+        '''
+        return self.mentions[:, [party_index[party] for party in parties]]
+
+    @property
+    def candidate_mentions(self):
+        '''
+        The sentences that mention each party, as sets of Sentence objects
+        '''
+        return {party: set(self.doc.sents[i] for i in
+                           numpy.flatnonzero(self.mentions[:, col]))
+                for party, col in party_index.items()}
+
+    def sentences_csv_file(self, output_file, empty=False, encoding='ascii',
+                           errors='strict'):
         with open(output_file, 'w') as handle:
             writer = csv.writer(handle)
             writer.writerow(['id', 'sentence', 'dem', 'rep', 'other'])
             for sent_id, sent in enumerate(self.doc.sents):
                 mentions = [('X' if not empty and
-                             sent in self.candidate_mentions[party] else '')
-                            for party in parties]
-                writer.writerow([str(sent_id), str(sent)] + mentions)
+                             self.mentions[sent.idx, party_index[party]]
+                             else '')
+                            for party in data.parties]
+                writer.writerow([str(sent_id), sent.encode(encoding, errors)] +
+                                mentions)
+
+
+class Corpus(object):
+    '''
+    The annotations of many documents, keyed by (year, debate, doc_id).
+
+        corpus = Corpus.load(annotations_dir, doc_keys, workers=4)
+        for key, annot in corpus.items():
+            ...
+
+    All documents intern their strings in one Vocabulary and share the
+    CandidateMatcher of their year. With workers > 1, load parses the XML
+    files in worker processes, which send them back in the compact form of
+    the sidecar cache (corenlp.pack_document); otherwise each file is
+    parsed when its document is first asked for. Either way the
+    DocAnnotation of a document is built on access and not kept.
+    '''
+
+    def __init__(self, annotations_dir, cache=False, engine='fast'):
+        self.annotations_dir = annotations_dir
+        self.cache = cache
+        self.engine = engine
+        self.vocab = corenlp.Vocabulary()
+        self._payloads = {}
+        self._keys = []
+        self._key_set = set()
+
+    @classmethod
+    def load(cls, annotations_dir, doc_keys=None, workers=1, cache=False,
+             engine='fast', chunksize=8):
+        '''
+        doc_keys: (year, debate, doc_id) tuples, by default those of all
+        annotations in annotations_dir.
+        cache, engine: as in corenlp.Document.
+        '''
+        corpus = cls(annotations_dir, cache, engine)
+        if doc_keys is None:
+            doc_keys = [key for key, _ in annotation_files(annotations_dir)]
+        corpus._keys = [tuple(int(x) for x in key) for key in doc_keys]
+        corpus._key_set = set(corpus._keys)
+        for year in set(key[0] for key in corpus._keys):
+            candidate_matcher(year)
 
+        if workers > 1 and corpus._keys:
+            tasks = [(corpus.path(key), cache, engine)
+                     for key in corpus._keys]
+            pool = multiprocessing.Pool(workers)
+            try:
+                for key, payload in zip(corpus._keys,
+                                        pool.imap(_pack_annotation, tasks,
+                                                  chunksize)):
+                    corpus._payloads[key] = payload
+            finally:
+                pool.terminate()
+        return corpus
 
-def create_sentence_annot_files(d):
+    def path(self, key):
+        return os.path.join(self.annotations_dir,
+                            '%s_%s_%03d.txt.xml' % tuple(key))
+
+    def document(self, key):
+        '''
+        The corenlp.Document of key
+        '''
+        key = tuple(key)
+        payload = self._payloads.get(key)
+        if payload is not None:
+            return corenlp.Document.from_payload(payload, self.vocab)
+        return corenlp.Document(self.path(key), cache=self.cache,
+                                vocab=self.vocab, engine=self.engine)
+
+    def __getitem__(self, key):
+        year, debate, doc_id = key
+        return DocAnnotation(self.annotations_dir, year, debate, doc_id,
+                             doc=self.document(key))
+
+    def __contains__(self, key):
+        return tuple(key) in self._key_set
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def items(self):
+        '''
+        Yield (key, DocAnnotation) pairs in the order of the keys
+        '''
+        for key in self._keys:
+            yield key, self[key]
+
+
+def _pack_annotation(args):
+    path, cache, engine = args
+    try:
+        return corenlp.pack_document(path, cache=cache, engine=engine)
+    except IOError:
+        # Raised again when the document is asked for
+        return None
+
+
+def annotation_files(d):
+    '''
+    Yield ((year, debate, doc_id), path) for every CoreNLP annotation in d
+    '''
+    for filename in sorted(os.listdir(d)):
+        match = annotation_re.match(filename)
+        if match is not None:
+            key = tuple(int(match.group(x))
+                        for x in ['year', 'debate', 'doc_id'])
+            yield key, os.path.join(d, filename)
+
+
+def build_annotation_store(d, store_dir):
+    '''
+    Build a memory-mapped store of all annotations in d, keyed by
+    (year, debate, doc_id). Open it with corenlp.store.Store(store_dir).
+    '''
+    corenlp_store.build(annotation_files(d), store_dir)
+
+
+def create_sentence_annot_files(d, workers=1, cache=False):
+    '''
+    Write the sentences of each document in for_annotation/doc_list.csv to
+    for_annotation/<year>_<debate>_<doc_id>.csv for hand annotation.
+    workers, cache: as in Corpus.load.
+    '''
     f = open(os.path.join(d, 'for_annotation', 'doc_list.csv'), 'rU')
-    reader = csv.DictReader(f)
-    for rec in reader:
+    recs = list(csv.DictReader(f))
+    corpus = Corpus.load(os.path.join(d, 'corenlp_annot'),
+                         [(rec['year'], rec['debate'], rec['doc_id'])
+                          for rec in recs], workers=workers,
+                         cache=cache)
+    for rec, key in zip(recs, corpus):
         try:
-            doc = DocAnnotation(os.path.join(d, 'corenlp_annot'),
-                                int(rec['year']), int(rec['debate']),
-                                int(rec['doc_id']))
+            doc = corpus[key]
         except IOError, exc:
             print exc
             continue
@@ -52,15 +291,29 @@ def create_sentence_annot_files(d):
         doc.sentences_csv_file(out_filename)
 
 
-def compare_all_annot_to_hand(d):
+def compare_all_annot_to_hand(d, workers=1, cache=False):
+    '''
+    Compare the NLP candidate mentions with the hand annotations of the
+    documents in for_annotation/doc_list.csv. Writes one row per sentence
+    and party to annot_comparison.csv, and precision, recall, F1 and the
+    confusion matrix by year and party (annot_agreement.csv) and by
+    publication and party (annot_agreement_by_publication.csv).
+    workers: number of processes that parse the annotations.
+    cache: use the sidecar caches of the annotations (see
+    corenlp.Document).
+    '''
     import pandas as pd
     f = open(os.path.join(d, 'for_annotation', 'doc_list.csv'), 'rU')
-    reader = csv.DictReader(f)
-    dicts = []
-    for rec in reader:
-        doc = DocAnnotation(os.path.join(d, 'corenlp_annot'),
-                            int(rec['year']), int(rec['debate']),
-                            int(rec['doc_id']))
+    recs = list(csv.DictReader(f))
+    corpus = Corpus.load(os.path.join(d, 'corenlp_annot'),
+                         [(rec['year'], rec['debate'], rec['doc_id'])
+                          for rec in recs], workers=workers,
+                         cache=cache)
+    columns = ['year', 'debate', 'doc_id', 'publication', 'id', 'party',
+               'hand', 'nlp', 'sentence']
+    chunks = {column: [] for column in columns}
+    for rec, key in zip(recs, corpus):
+        doc = corpus[key]
         filename = '%s_%s_%03d.final.csv' % (rec['year'], rec['debate'], 
                                              int(rec['doc_id']))
         filename = os.path.join(d, 'hand_annot', filename)
@@ -70,23 +323,60 @@ def compare_all_annot_to_hand(d):
             print exc
             continue
 
-        assert len(doc.doc.sents) == len(hand_annot)
-        for nlp_sent, hand_sent in zip(doc.doc.sents, hand_annot):
-            shared = dict(year=rec['year'],
-                          debate=rec['debate'],
-                          doc_id=rec['doc_id'],
-                          sentence=hand_sent['sentence'],
-                          id=hand_sent['id'])
-            for party in data.candidates[int(rec['year'])].keys():
-                dic = shared.copy()
-                dic['party'] = party
-                nlp = 'T' if nlp_sent in doc.candidate_mentions[party] else 'F'
-                dic['nlp'] = nlp
-                dic['hand'] = hand_sent.get(party, 'N/A')
-                dicts.append(dic)
-
-    columns = ['year', 'debate', 'doc_id', 'id', 'party', 'hand', 'nlp',
-               'sentence']
-    df = pd.DataFrame.from_records(dicts, columns=columns)
+        n_sents = len(doc.doc.sents)
+        assert n_sents == len(hand_annot)
+        parties = data.candidates[int(rec['year'])].keys()
+        n_rows = n_sents * len(parties)
+
+        # Rows are ordered by sentence, then party
+        for column in ['year', 'debate', 'doc_id']:
+            chunks[column].append(numpy.repeat(rec[column], n_rows))
+        chunks['publication'].append(
+            numpy.repeat(rec.get('publication', 'n/a'), n_rows))
+        for column in ['id', 'sentence']:
+            values = numpy.array([h[column] for h in hand_annot],
+                                 dtype=object)
+            chunks[column].append(numpy.repeat(values, len(parties)))
+        chunks['party'].append(numpy.tile(numpy.array(parties, dtype=object),
+                                          n_sents))
+        hand = numpy.array([[h.get(party, 'N/A') for party in parties]
+                            for h in hand_annot], dtype=object)
+        chunks['hand'].append(hand.reshape(n_rows))
+        chunks['nlp'].append(numpy.where(
+            doc.party_mentions(parties).reshape(n_rows), 'T', 'F'))
+
+    df = pd.DataFrame({column: (numpy.concatenate(chunks[column])
+                                if chunks[column] else [])
+                       for column in columns},
+                      columns=columns)
     df.to_csv(os.path.join(d, 'annot_comparison.csv'))
+    agreement_report(df, ['year', 'party']).to_csv(
+        os.path.join(d, 'annot_agreement.csv'))
+    agreement_report(df, ['publication', 'party']).to_csv(
+        os.path.join(d, 'annot_agreement_by_publication.csv'))
     return df
+
+
+def agreement_report(df, by):
+    '''
+    Confusion matrix (tp, fp, fn, tn), precision, recall and F1 of the NLP
+    annotations against the hand annotations of df, as returned by
+    compare_all_annot_to_hand, grouped by the columns in by. Rows without
+    a hand annotation ('N/A') are left out.
+    '''
+    import pandas as pd
+    df = df[df['hand'] != 'N/A']
+    nlp = (df['nlp'] == 'T').values
+    hand = df['hand'].isin(hand_true_values).values
+    counts = pd.DataFrame({'tp': nlp & hand,
+                           'fp': nlp & ~hand,
+                           'fn': ~nlp & hand,
+                           'tn': ~nlp & ~hand},
+                          columns=['tp', 'fp', 'fn', 'tn'], index=df.index,
+                          dtype=int)
+    report = counts.groupby([df[column] for column in by]).sum()
+    report['precision'] = report['tp'] / (report['tp'] + report['fp'])
+    report['recall'] = report['tp'] / (report['tp'] + report['fn'])
+    report['f1'] = (2 * report['precision'] * report['recall'] /
+                    (report['precision'] + report['recall']))
+    return report
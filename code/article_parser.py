@@ -1,10 +1,25 @@
+import cPickle
 import csv
+import itertools
+import multiprocessing
 import os
 import re
-import subprocess
+import shutil
+import time
+
+import numpy
 
 import data
+import dedup
+import instrument
+import output
+import pipelined
 from annot import DocAnnotation
+from corenlp import pack as corenlp_pack
+from corenlp import pipeline
+from corenlp import server as corenlp_server
+from corenlp import store as corenlp_store
+from corenlp.cache import md5_file
 
 header_re = re.compile(r'(?P<doc_id>\d+) of (?P<total_docs>\d+) DOCUMENTS[\r\n]+')
 fields = ['byline', 'section', 'length', 'dateline', 'load-date',
@@ -12,6 +27,10 @@ fields = ['byline', 'section', 'length', 'dateline', 'load-date',
           'journal-code', 'document-type']
 additional_fields = ['year', 'debate_number', 'doc_id', 'publication',
                      'date', 'title', 'text', 'total_docs']
+output_fields = ['year', 'debate_number', 'doc_id', 'publication', 'byline']
+_manifest_version = 1
+_pack_readers = {}
+_stores = {}
 
 
 class ArticleParser(object):
@@ -22,19 +41,38 @@ class ArticleParser(object):
                        os.path.expanduser('~/Dropbox/debates/corenlp'), '3.3.1')
     ap.load()
     if CoreNLP hasn't been run yet:
-        ap.dump_to_dir()
+        ap.dump_to_dir(deduplicate=True)
         ap.run_corenlp()
     ap.final_output(output_filename)
+    ap.stats.write_json('run_stats.json')
+    or all stages at once, overlapping each other:
+        ap.run_pipelined(output_filename)
+    with packed=True in the constructor, dump_to_dir, run_corenlp and
+    final_output keep all texts and all annotations in two packs (see
+    corenlp.pack) instead of a file each; run_pipelined does not.
     '''
 
     def __init__(self, docs_dir, annotations_dir, doc_text_dir,
-                 corenlp_dir, corenlp_version):
+                 corenlp_dir, corenlp_version, stats=None, packed=False):
+        '''
+        stats: instrument.Stats that collects the timings and counters of
+        each stage, a new one by default.
+        packed: write the texts to doc_text_dir/texts.pack and the
+        annotations to annotations_dir/annotations.pack instead of one file
+        per document, which is much faster on network file systems.
+        '''
         self.docs = []
+        self.stats = stats if stats is not None else instrument.Stats()
         self.docs_dir = docs_dir
         self.annotations_dir = annotations_dir
         self.doc_text_dir = doc_text_dir
         self.corenlp_dir = corenlp_dir
         self.corenlp_version = corenlp_version
+        self.packed = packed
+        if packed:
+            self.text_pack = os.path.join(doc_text_dir, 'texts.pack')
+            self.annotation_pack = os.path.join(annotations_dir,
+                                                'annotations.pack')
 
     def process_body(self, body):
         doc = {}
@@ -65,116 +103,807 @@ class ArticleParser(object):
             doc['date'], doc['title'] = doc['title'], doc['date']
 
     def process_file(self, filename, metadata={}):
-        raw = open(filename).read()
-        matches = re.split(header_re, raw)[1:]
-        assert len(matches) % 3 == 0
-        for i in range(0, len(matches), 3): 
-            doc = metadata.copy()
-            doc['doc_id'], doc['total_docs'], body = matches[i:i+3]
-            doc.update(self.process_body(body))
-            self.post_process_doc(doc)
-            self.docs.append(doc)
+        self.docs.extend(self.parse_file(filename, metadata))
 
-    def dump_to_dir(self):
+    def parse_file(self, filename, metadata={}):
+        '''
+        Return the list of documents in a LexisNexis export
+        '''
+        return list(self.iter_file(filename, metadata))
+
+    def iter_file(self, filename, metadata={}, chunk_size=1 << 20):
+        '''
+        Yield the documents of a LexisNexis export one at a time. The file
+        is read in chunks, so only the document being parsed is held in
+        memory.
+        '''
+        with open(filename) as handle:
+            for doc_id, total_docs, body in _split_export(handle, chunk_size):
+                doc = metadata.copy()
+                doc['doc_id'], doc['total_docs'] = doc_id, total_docs
+                doc.update(self.process_body(body))
+                self.post_process_doc(doc)
+                yield doc
+
+    def iter_docs(self):
+        '''
+        Yield the documents of all exports in docs_dir without storing
+        them in self.docs, e.g. ap.dump_to_dir(ap.iter_docs()), in the
+        order of load. As in load, an export that cannot be read is
+        skipped and its error recorded in self.load_errors; the documents
+        it yielded before the error are kept.
+        '''
+        self.load_errors = {}
+        for path, metadata, _ in self._exports(self.load_errors):
+            try:
+                for doc in self.iter_file(path, metadata):
+                    yield doc
+            except Exception, exc:
+                self.load_errors[os.path.basename(path)] = '%s: %s' % (
+                    type(exc).__name__, exc)
+                self.stats.count('export_errors')
+        self._print_load_errors()
+
+    def _exports(self, errors=None):
+        '''
+        Yield the (path, metadata, os.stat result) of each export in
+        docs_dir, by year and debate number. Since LexisNexis numbers the
+        documents of an export in order, their documents come in the order
+        load sorts them in. errors: dict to record the exports whose name
+        or file cannot be read in, by file name, instead of raising.
+        '''
+        exports = []
+        for filename in os.listdir(self.docs_dir):
+            if filename[0] == '.':
+                continue
+            path = os.path.join(self.docs_dir, filename)
+            try:
+                base, ext = os.path.splitext(filename)
+                year, _, _, debate_number = base.split()
+                key = int(year), int(debate_number)
+                st = os.stat(path)
+            except (ValueError, OSError), exc:
+                if errors is None:
+                    raise
+                errors[filename] = '%s: %s' % (type(exc).__name__, exc)
+                self.stats.count('export_errors')
+                continue
+            exports.append((key, path,
+                            {'year': year, 'debate_number': debate_number},
+                            st))
+        exports.sort()
+        for _, path, metadata, st in exports:
+            yield path, metadata, st
+
+    def _print_load_errors(self):
+        for filename, error in sorted(self.load_errors.items()):
+            print 'Could not parse %s: %s' % (filename, error)
+
+    def dump_to_dir(self, docs=None, deduplicate=False,
+                    near_duplicates=False, threshold=0.9):
         '''
         Dump all files one by one 
+        docs: iterable of documents, self.docs by default.
+        deduplicate: only dump one document of each group of documents
+        with the same text (see dedup.py), and list the others in
+        duplicates.csv, so that run_corenlp annotates the text once and
+        copies the annotation to the others. With near_duplicates, texts
+        with an estimated similarity of at least threshold count as the
+        same.
         '''
+        if docs is None:
+            docs = self.docs
         if not os.path.exists(self.doc_text_dir):
             os.mkdir(self.doc_text_dir)
 
-        filenames = []
-        for doc in self.docs:
-            filename = '%s_%s_%03d.txt' % (doc['year'], doc['debate_number'],
-                                           int(doc['doc_id']))
-            full_filename = os.path.join(self.doc_text_dir, filename)
-            filenames.append(full_filename)
+        with self.stats.timer('dump_to_dir'):
+            copies = {}
+            if deduplicate:
+                docs = list(docs)
+                for group in dedup.duplicate_groups(docs, near_duplicates,
+                                                    threshold):
+                    for i in group[1:]:
+                        copies[i] = group[0]
+                self.stats.count('documents_deduplicated', len(copies))
+            if self.packed:
+                with corenlp_pack.PackWriter(self.text_pack) as pack:
+                    filenames = [self._dump_doc(doc, pack)
+                                 for i, doc in enumerate(docs)
+                                 if i not in copies]
+            else:
+                filenames = [self._dump_doc(doc)
+                             for i, doc in enumerate(docs) if i not in copies]
+            self._write_file_list(filenames)
+            self._write_duplicates(
+                [(self._text_filename(docs[i]), self._text_filename(docs[j]))
+                 for i, j in sorted(copies.items())])
+
+    def _text_filename(self, doc):
+        filename = '%s_%s_%03d.txt' % (doc['year'], doc['debate_number'],
+                                       int(doc['doc_id']))
+        return os.path.join(self.doc_text_dir, filename)
+
+    def _dump_doc(self, doc, pack=None):
+        '''
+        Write the text of doc to doc_text_dir, or to pack (a
+        corenlp.pack.PackWriter) under the file's name, and return the
+        file's path
+        '''
+        full_filename = self._text_filename(doc)
+        if pack is not None:
+            pack.add(os.path.basename(full_filename), doc['text'])
+        else:
             with open(full_filename, 'w') as handle:
                 handle.write(doc['text'])
+        self.stats.count('documents_written')
+        self.stats.count('text_bytes_written', len(doc['text']))
+        return full_filename
 
+    def _write_file_list(self, filenames):
         file_list_name = os.path.join(self.doc_text_dir, 'file_list.txt')
         with open(file_list_name, 'w') as handle:
             handle.write('\n'.join(filenames))
 
-    def run_corenlp(self):
+    def _write_duplicates(self, pairs):
+        '''
+        Record (copy, representative) text file pairs for run_corenlp. A
+        run without duplicates removes the list of an earlier run.
+        '''
+        duplicates_name = os.path.join(self.doc_text_dir, 'duplicates.csv')
+        if pairs:
+            dedup.write_duplicates(duplicates_name, pairs)
+        elif os.path.exists(duplicates_name):
+            os.remove(duplicates_name)
+
+    def _copy_annotation(self, copy, representative):
+        '''
+        Give the text file copy the annotation of the text file
+        representative. Returns False if representative has none.
+        '''
+        source = pipeline._output_path(representative, self.annotations_dir,
+                                       False)
+        target = pipeline._output_path(copy, self.annotations_dir, False)
+        if not os.path.exists(source):
+            return False
+        if (not os.path.exists(target) or
+                os.path.getmtime(target) < os.path.getmtime(source)):
+            shutil.copyfile(source, target)
+        self.stats.count('documents_fanned_out')
+        return True
+
+    def _fan_out(self):
+        '''
+        Copy the annotations of the documents dumped by dump_to_dir to the
+        duplicates that were left out. Returns the number of copies that
+        got an annotation and the copies whose representative has none.
+        '''
+        duplicates_name = os.path.join(self.doc_text_dir, 'duplicates.csv')
+        if not os.path.exists(duplicates_name):
+            return 0, []
+        pairs = dedup.read_duplicates(duplicates_name)
+        if self.packed:
+            return self._fan_out_packed(pairs)
+        failed = [copy for copy, representative in pairs
+                  if not self._copy_annotation(copy, representative)]
+        return len(pairs) - len(failed), failed
+
+    def _fan_out_packed(self, pairs):
+        '''
+        _fan_out for annotations in annotation_pack
+        '''
+        if not os.path.exists(self.annotation_pack):
+            return 0, [copy for copy, _ in pairs]
+        annotations = corenlp_pack.PackReader(self.annotation_pack)
+        failed = []
+        try:
+            with corenlp_pack.PackWriter(self.annotation_pack,
+                                         append=True) as out:
+                for copy, representative in pairs:
+                    source = os.path.basename(representative) + '.xml'
+                    target = os.path.basename(copy) + '.xml'
+                    if source not in annotations:
+                        failed.append(copy)
+                        continue
+                    if (target not in annotations or
+                            annotations.entry(target) <
+                            annotations.entry(source)):
+                        out.add(target, annotations.read(source))
+                    self.stats.count('documents_fanned_out')
+        finally:
+            annotations.close()
+        return len(pairs) - len(failed), failed
+
+    def _report_saved(self, stage, n_copies):
+        '''
+        Estimate the annotation time saved by annotating n_copies fewer
+        documents from the mean time per document annotated in stage
+        '''
+        if not n_copies:
+            return
+        counters = self.stats.stages[stage]['counters']
+        seconds = counters.get('jvm_seconds') or \
+            self.stats.stages[stage]['seconds']
+        annotated = counters.get('documents_annotated')
+        if annotated:
+            saved = seconds / annotated * n_copies
+            self.stats.count('annotation_seconds_saved', saved, stage=stage)
+            print ('Deduplication saved annotating %d documents (about '
+                   '%.0f seconds)' % (n_copies, saved))
+        else:
+            print 'Deduplication saved annotating %d documents' % n_copies
+
+    def run_corenlp(self, server=None, processes=1, threads=1, mem='2g',
+                    retries=2):
         '''
         dirname: path to temporary files created by dump_to_dir.
         corenlpdir: path to Stanford CoreNLP.
+        server: URL of a running CoreNLP server (see corenlp.server). If
+        given, documents are sent to the server instead of starting a JVM.
+        processes: number of CoreNLP JVMs to run at once; mem is the total
+        heap shared between them and threads the number of threads in
+        each. Documents that already have an up-to-date annotation are
+        skipped, so an interrupted run can be resumed.
         '''
         if not os.path.exists(self.annotations_dir):
             os.mkdir(self.annotations_dir)
 
-        file_list = os.path.join(self.doc_text_dir, 'file_list.txt')
-        cwd = os.getcwd()
-        os.chdir(self.corenlp_dir)
+        if not self.packed:
+            file_list = os.path.join(self.doc_text_dir, 'file_list.txt')
+            with open(file_list) as handle:
+                files = handle.read().splitlines()
 
-        try:
-            command = 'java -cp stanford-corenlp-%s.jar:stanford-corenlp-%s-models.jar:xom.jar:joda-time.jar:jollyday.jar:ejml-0.23.jari -Xmx2g edu.stanford.nlp.pipeline.StanfordCoreNLP -annotators tokenize,ssplit,pos,lemma,ner,parse,dcoref -filelist %s -outputDirectory %s' % (self.corenlp_version, self.corenlp_version, file_list, self.annotations_dir)
-            subprocess.call(command.split())
-        finally:
-            os.chdir(cwd)
+        if server is not None:
+            def annotated(name):
+                self.stats.count('documents_annotated', stage='run_corenlp')
+
+            with self.stats.timer('run_corenlp'):
+                if self.packed:
+                    failed = corenlp_server.pack2pack(
+                        self.text_pack, self.annotation_pack, url=server,
+                        callback=annotated)
+                else:
+                    failed = corenlp_server.files2dir(
+                        files, self.annotations_dir, url=server,
+                        callback=annotated)
+                self.stats.count('documents_failed', len(failed))
+        else:
+            def shard_done(shard, returncode, seconds):
+                self.stats.count('jvm_runs', stage='run_corenlp')
+                self.stats.count('jvm_seconds', seconds, stage='run_corenlp')
+                if returncode == 0:
+                    self.stats.count('documents_annotated', len(shard),
+                                     stage='run_corenlp')
+
+            options = dict(processes=processes, mem_budget=mem,
+                           libdir=self.corenlp_dir,
+                           libver=self.corenlp_version, threads=threads,
+                           retries=retries, callback=shard_done)
+            with self.stats.timer('run_corenlp'):
+                if self.packed:
+                    failed = pipeline.pack2pack(self.text_pack,
+                                                self.annotation_pack,
+                                                **options)
+                else:
+                    failed = pipeline.files2dir_sharded(
+                        files, self.annotations_dir,
+                        replace_extension=False, **options)
+                self.stats.count('documents_failed', len(failed))
+
+        with self.stats.timer('fan_out'):
+            n_copies, failed_copies = self._fan_out()
+        self._report_saved('run_corenlp', n_copies)
+        failed = failed + failed_copies
+        if failed:
+            print 'CoreNLP failed on %d documents' % len(failed)
 
-    def alldoc_csv(self, filename='/tmp/tmp.csv'):
+    def alldoc_csv(self, filename='/tmp/tmp.csv', docs=None):
         '''
         Create a CSV file with all doc metadata and 100 first characters of 
         each document
+        docs: iterable of documents, self.docs by default.
         '''
+        if docs is None:
+            docs = self.docs
         writer = csv.writer(open(filename, 'w'))
         all_fields = additional_fields + fields
         writer.writerow(all_fields)
-        for doc in self.docs:
+        for doc in docs:
             writer.writerow([doc.get(field, '')[:100] for field in all_fields])
 
-    def load(self):
-        for filename in os.listdir(self.docs_dir):
-            if filename[0] == '.':
-                continue
-            base, ext = os.path.splitext(filename)
-            year, _, _, debate_number = base.split()
-            self.process_file(os.path.join(self.docs_dir, filename), 
-                              {'year': year, 'debate_number': debate_number})
+    def load(self, store=None, workers=1):
+        '''
+        store: path to a pickle file holding the documents parsed from each
+        export together with the export's size, mtime and md5. Exports that
+        have not changed since the store was written are read from it
+        instead of being parsed again; the store is then updated with the
+        ones that were parsed.
+        workers: number of processes that parse exports.
+        The documents are added to self.docs sorted by year, debate number
+        and doc_id. An export that cannot be parsed, or whose name is not
+        of the form '<year> ... <debate number>', is left out and its error
+        recorded in self.load_errors, by file name.
+        '''
+        self.load_errors = {}
+        with self.stats.timer('load'):
+            manifest = _read_manifest(store) if store is not None else {}
+            new_manifest = {}
+            changed = False
+            to_parse = []
+            for path, metadata, st in self._exports(self.load_errors):
+                filename = os.path.basename(path)
+                entry = manifest.get(filename)
+                if entry is None or not _entry_matches(entry, path, st):
+                    to_parse.append((path, metadata, st))
+                else:
+                    self.stats.count('exports_cached')
+                    if entry['mtime'] != st.st_mtime:
+                        entry = dict(entry, mtime=st.st_mtime)
+                        changed = True
+                    new_manifest[filename] = entry
 
-    def final_output(self, output_file='/tmp/debate_sentences.csv'):
-        writer = csv.writer(open(output_file, 'w'))
-        fields = ['year', 'debate_number', 'doc_id', 'publication', 'byline']
-        writer.writerow(fields + ['party', 'text'])
+            # The md5 is only needed to write the store
+            tasks = [(type(self), path, metadata, store is not None)
+                     for path, metadata, _ in to_parse]
+            if workers > 1 and len(tasks) > 1:
+                pool = multiprocessing.Pool(min(workers, len(tasks)))
+                results = pool.imap(_parse_export, tasks)
+            else:
+                pool = None
+                results = itertools.imap(_parse_export, tasks)
+            try:
+                for (path, metadata, st), (docs, md5, error) in \
+                        itertools.izip(to_parse, results):
+                    filename = os.path.basename(path)
+                    if error is not None:
+                        self.load_errors[filename] = error
+                        self.stats.count('export_errors')
+                        continue
+                    self.stats.count('exports_parsed')
+                    self.stats.count('export_bytes_read', st.st_size)
+                    self.stats.count('documents_parsed', len(docs))
+                    new_manifest[filename] = {'size': st.st_size,
+                                              'mtime': st.st_mtime,
+                                              'md5': md5,
+                                              'docs': docs}
+                    changed = True
+            finally:
+                if pool is not None:
+                    pool.terminate()
+
+            docs = [doc for entry in new_manifest.values()
+                    for doc in entry['docs']]
+            docs.sort(key=_doc_key)
+            self.docs.extend(docs)
+            self.stats.count('documents', len(docs))
+
+            changed = changed or len(new_manifest) != len(manifest)
+            if store is not None and changed:
+                _write_manifest(store, new_manifest)
+
+        self._print_load_errors()
 
-        max_field_size = 30000
+    def final_output(self, output_file='/tmp/debate_sentences.csv',
+                     workers=1, chunksize=4, store=None, format=None,
+                     encoding='ascii', errors='replace', cache=False):
+        '''
+        workers: number of processes that parse and annotate documents.
+        Rows are written in the order of self.docs whatever the number
+        of workers.
+        store: directory of an annotation store (see
+        annot.build_annotation_store) to read documents from instead of
+        parsing the CoreNLP XML files. Workers share its mapped arrays.
+        format: 'csv', 'jsonl' or 'parquet' (see output.py); guessed from
+        the extension of output_file by default.
+        encoding, errors: how sentences are encoded (see _encode_sentences).
+        By default the characters that are not ASCII are replaced with
+        '?'; e.g. encoding='utf-8' keeps them all, and errors='drop' leaves
+        out and counts as Unicode errors the sentences that are not ASCII,
+        as final_output used to.
+        The JSON lines and Parquet writers read the metadata in encoding
+        as well, replacing the bytes that are not valid in it.
+        cache: read each CoreNLP XML file from its sidecar cache (see
+        corenlp.Document) when it is up to date, and write the sidecar
+        otherwise, so that later runs skip parsing the XML.
+        '''
+        if store is not None:
+            # Open the store once here; forked workers inherit it, and the
+            # tasks only carry its path
+            _open_store(store)
+        pack = self.annotation_pack if self.packed else None
+        tasks = ((self.annotations_dir, doc, store, encoding, errors, pack,
+                  cache)
+                 for doc in self.docs)
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap(_doc_rows, tasks, chunksize)
+        else:
+            pool = None
+            results = itertools.imap(_doc_rows, tasks)
 
         n_unicode_errors = 0
-        for doc in self.docs:
-            year, debate, doc_id = [int(doc[x]) for x in 
-                                    ['year', 'debate_number', 'doc_id']]
-            annot = DocAnnotation(self.annotations_dir, year, debate, doc_id)
-            
-            parties = data.candidates[year].keys()
-            all_types = parties + ['none', 'multiple']
-            sents_by_cand = {x: [] for x in all_types}
-
-            for sent in annot.doc.sents:
-                mentions = [party for party in parties 
-                            if sent in annot.candidate_mentions[party]]
-                # Only sentences that mention exactly one candidate
-                if len(mentions) == 0:
-                    cand = 'none'
-                elif len(mentions) == 1:
-                    cand = mentions[0]
-                else:
-                    cand = 'multiple'
-                sents_by_cand[cand].append(sent)
+        try:
+            with self.stats.timer('final_output'), \
+                    output.open_writer(output_file, output_fields, format,
+                                       encoding=encoding) as writer:
+                for doc, (rows, doc_unicode_errors, counters) in \
+                        itertools.izip(self.docs, results):
+                    for row in rows:
+                        writer.write(*row)
+                    n_unicode_errors += doc_unicode_errors
+                    self.stats.document(
+                        _doc_key(doc), rows_written=len(rows),
+                        unicode_errors=doc_unicode_errors, **counters)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        print '%d Unicode errors' % n_unicode_errors
 
-            for cand in all_types:
-                as_str = []
-                for sent in sents_by_cand[cand]:
+    def run_pipelined(self, output_file='/tmp/debate_sentences.csv',
+                      server=None, processes=1, threads=1, mem='2g',
+                      retries=2, batch_size=20, workers=1, queue_size=64,
+                      format=None, deduplicate=False, encoding='ascii',
+                      errors='replace', cache=False):
+        '''
+        Do the work of load, dump_to_dir, run_corenlp and final_output in
+        one pass (see pipelined.py): documents are split from the exports,
+        dumped, annotated, searched for candidate mentions and written to
+        output_file as they go, so that the stages overlap and the first
+        rows are written long before the last document is annotated.
+        server: URL of a CoreNLP server to send the documents to. By
+        default batches of batch_size documents are annotated by up to
+        `processes` CoreNLP JVMs at once, with threads threads each and
+        an equal share of mem.
+        workers: number of processes that look for candidate mentions.
+        queue_size: number of documents that may wait between two stages.
+        deduplicate: annotate documents whose text is the same as that of
+        an earlier document (see dedup.py) by copying its annotation.
+        Near duplicates need all texts up front; use dump_to_dir for them.
+        encoding, errors, cache: as in final_output.
+        The documents are added to self.docs, in the order of load, and
+        the exports that cannot be read are recorded in self.load_errors
+        (see iter_docs). Returns the text files that could not be
+        annotated; their documents are left out of the output.
+        '''
+        if self.packed:
+            raise ValueError('run_pipelined writes a file per document; use '
+                             'dump_to_dir and run_corenlp with packs')
+        for dirname in [self.doc_text_dir, self.annotations_dir]:
+            if not os.path.exists(dirname):
+                os.mkdir(dirname)
+        # Fork the workers before the pipeline starts its threads
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        pipe = pipelined.Pipeline(queue_size, self.stats)
+        filenames = []
+        failed = []
+        representatives = {}
+        copies = []
+        client = None
+
+        def dump(doc):
+            # Documents are dumped in order, so a copy always comes after
+            # its representative
+            self.docs.append(doc)
+            filename = self._text_filename(doc)
+            representative = None
+            if deduplicate:
+                representative = representatives.setdefault(
+                    dedup.text_hash(doc['text']), filename)
+            if representative in (None, filename):
+                representative = None
+                filenames.append(self._dump_doc(doc))
+            else:
+                copies.append((filename, representative))
+            return doc, filename, representative
+
+        def fan_out(item):
+            doc, filename, representative = item
+            if representative is not None:
+                if representative in failed or \
+                        not self._copy_annotation(filename, representative):
+                    failed.append(filename)
+                    return None
+            return (self.annotations_dir, doc, None, encoding, errors, None,
+                    cache)
+
+        docs = pipe.source('split', self.iter_docs())
+        dumped = pipe.map('dump', dump, docs)
+
+        if server is not None:
+            client = corenlp_server.Client(server, retries=retries)
+
+            def annotate(item):
+                doc, filename, representative = item
+                if representative is None and not pipeline._up_to_date(
+                        filename, self.annotations_dir, False):
                     try:
-                        as_str.append(str(sent))
-                    except UnicodeEncodeError:
-                        n_unicode_errors += 1
+                        xml = client.annotate(doc['text'])
+                    except corenlp_server.ServerError:
+                        failed.append(filename)
+                        return None
+                    out_path = pipeline._output_path(
+                        filename, self.annotations_dir, False)
+                    with open(out_path, 'wb') as handle:
+                        handle.write(xml)
+                    self.stats.count('documents_annotated')
+                return item
+
+            annotated = pipe.map('annotate', annotate, dumped,
+                                 threads=client.pool_size)
+        else:
+            jvm_mem = '%dm' % (pipeline._parse_mem(mem) // processes)
+
+            def batches(items):
+                batch = []
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+
+            def shard_done(shard, returncode, seconds):
+                self.stats.count('jvm_runs', stage='annotate')
+                self.stats.count('jvm_seconds', seconds, stage='annotate')
+                if returncode == 0:
+                    self.stats.count('documents_annotated', len(shard),
+                                     stage='annotate')
+
+            def annotate(batch):
+                files = [filename for _, filename, representative in batch
+                         if representative is None]
+                if not files:
+                    return batch
+                batch_failed = pipeline.files2dir_sharded(
+                    files, self.annotations_dir, mem_budget=jvm_mem,
+                    libdir=self.corenlp_dir, libver=self.corenlp_version,
+                    threads=threads, shard_size=len(files), retries=retries,
+                    replace_extension=False, poll_interval=0.1,
+                    callback=shard_done)
+                failed.extend(batch_failed)
+                return [item for item in batch if item[1] not in batch_failed]
 
-                text = ' '.join(as_str)
-                values = [doc.get(field, 'n/a') for field in fields]
-                row = values + [cand]
-                for i in range(0, len(text), max_field_size):
-                    row.append(text[i:i+max_field_size])
-                writer.writerow(row)
+            def unbatch(batches):
+                for batch in batches:
+                    for item in batch:
+                        yield item
+
+            annotated = pipe.stage(
+                'unbatch', unbatch,
+                pipe.map('annotate', annotate,
+                         pipe.stage('batch', batches, dumped),
+                         threads=processes))
+
+        # Copies are handled one at a time and in order, once their
+        # representative has been annotated
+        tasks = pipe.map('fan_out', fan_out, annotated)
+        results = pipe.map('mentions', _doc_rows_with_doc, tasks, pool=pool)
+
+        n_unicode_errors = 0
+        try:
+            with self.stats.timer('run_pipelined'), \
+                    output.open_writer(output_file, output_fields, format,
+                                       encoding=encoding) as writer:
+                for doc, (rows, doc_unicode_errors, counters) in \
+                        pipe.results(results):
+                    with self.stats.timer('output'):
+                        for row in rows:
+                            writer.write(*row)
+                    n_unicode_errors += doc_unicode_errors
+                    self.stats.document(
+                        _doc_key(doc), stage='mentions',
+                        rows_written=len(rows),
+                        unicode_errors=doc_unicode_errors, **counters)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            # pipe.results has stopped the annotate threads by now
+            if client is not None:
+                client.close()
+        self._write_file_list(filenames)
+        self._write_duplicates(copies)
+        self.stats.count('documents_failed', len(failed),
+                         stage='run_pipelined')
+        self.stats.count('documents_deduplicated', len(copies),
+                         stage='dump')
 
         print '%d Unicode errors' % n_unicode_errors
+        failed_set = set(failed)
+        self._report_saved('annotate', len([copy for copy, _ in copies
+                                            if copy not in failed_set]))
+        if failed:
+            print 'CoreNLP failed on %d documents' % len(failed)
+        return failed
+
+
+def _split_export(handle, chunk_size):
+    '''
+    Split a LexisNexis export read from handle into (doc_id, total_docs,
+    body) tuples at the "N of M DOCUMENTS" headers, like
+    re.split(header_re, raw) but without reading the whole file. Text
+    before the first header is skipped.
+    '''
+    buf = ''
+    current = None
+    while True:
+        chunk = handle.read(chunk_size)
+        eof = not chunk
+        # Only rescan the tail of the previous buffer, backing up to the
+        # start of any number so that a header cut by the chunk boundary
+        # is matched in full.
+        scan_from = max(0, len(buf) - 256)
+        while scan_from > 0 and buf[scan_from - 1].isdigit():
+            scan_from -= 1
+        buf += chunk
+        start = 0
+        for match in header_re.finditer(buf, scan_from):
+            if not eof and match.end() == len(buf):
+                # The header's trailing newlines may continue in the next
+                # chunk.
+                break
+            if current is not None:
+                yield current + (buf[start:match.start()],)
+            current = (match.group('doc_id'), match.group('total_docs'))
+            start = match.end()
+        buf = buf[start:]
+        if eof:
+            if current is not None:
+                yield current + (buf,)
+            return
+
+
+def _parse_export(args):
+    '''
+    Parse an export with a parser of class cls. Returns (docs, md5 of the
+    export if with_md5 else None, None), or (None, None, error message) if
+    the export cannot be parsed. Defined at module level so that it can be
+    sent to worker processes.
+    '''
+    cls, path, metadata, with_md5 = args
+    try:
+        docs = cls.__new__(cls).parse_file(path, metadata)
+        return docs, md5_file(path) if with_md5 else None, None
+    except Exception, exc:
+        return None, None, '%s: %s' % (type(exc).__name__, exc)
+
+
+def _doc_key(doc):
+    return tuple(int(doc[x]) for x in ['year', 'debate_number', 'doc_id'])
+
+
+def _read_manifest(store):
+    try:
+        with open(store, 'rb') as handle:
+            manifest = cPickle.load(handle)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return {}
+    if manifest.get('version') != _manifest_version:
+        return {}
+    return manifest['files']
+
+
+def _write_manifest(store, files):
+    tmp_store = '%s.%d.tmp' % (store, os.getpid())
+    with open(tmp_store, 'wb') as handle:
+        cPickle.dump({'version': _manifest_version, 'files': files}, handle,
+                     cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_store, store)
+
+
+def _entry_matches(entry, path, st):
+    if entry['size'] != st.st_size:
+        return False
+    if entry['mtime'] == st.st_mtime:
+        return True
+    # Touched but possibly unchanged
+    return entry['md5'] == md5_file(path)
+
+
+def _doc_rows(args):
+    '''
+    Build the final_output rows of a single document as (metadata values,
+    party, sentence strings) tuples. Returns them with the number of
+    sentences that could not be encoded and a dict of counters for
+    instrument.Stats.document. Defined at module level so that it can be
+    sent to worker processes.
+    '''
+    annotations_dir, doc, store, encoding, errors, pack, cache = args
+    if store is not None:
+        store = _open_store(store)
+
+    start = time.time()
+    n_unicode_errors = 0
+    year, debate, doc_id = [int(doc[x]) for x in
+                            ['year', 'debate_number', 'doc_id']]
+    xml_name = '%s_%s_%03d.txt.xml' % (year, debate, doc_id)
+    if pack is not None:
+        pack = _pack_reader(pack)
+        xml_bytes = pack.size(xml_name)
+    elif store is None:
+        xml_bytes = os.path.getsize(os.path.join(annotations_dir, xml_name))
+    else:
+        xml_bytes = 0
+    annot = DocAnnotation(annotations_dir, year, debate, doc_id, cache=cache,
+                          store=store, pack=pack)
+
+    parties = data.candidates[year].keys()
+    all_types = parties + ['none', 'multiple']
+    sents_by_cand = {x: [] for x in all_types}
+
+    # Only sentences that mention exactly one candidate are assigned to
+    # that candidate's party
+    mentions = annot.party_mentions(parties)
+    n_mentions = mentions.sum(axis=1)
+    types = numpy.where(n_mentions == 1, mentions.argmax(axis=1),
+                        numpy.where(n_mentions == 0, len(parties),
+                                    len(parties) + 1))
+    for sent, t in zip(annot.doc.sents, types):
+        sents_by_cand[all_types[t]].append(sent)
+
+    values = [doc.get(field, 'n/a') for field in output_fields]
+    rows = []
+    for cand in all_types:
+        as_str, n_dropped = _encode_sentences(sents_by_cand[cand], encoding,
+                                              errors)
+        n_unicode_errors += n_dropped
+        rows.append((values, cand, as_str))
+
+    counters = {'seconds': time.time() - start,
+                'xml_bytes': xml_bytes,
+                'sentences': len(annot.doc.sents),
+                'tokens': sum(len(sent) for sent in annot.doc.sents),
+                'chains_scanned': len(annot.doc.mention_chains)}
+    return rows, n_unicode_errors, counters
+
+
+def _pack_reader(path):
+    '''
+    A PackReader of path shared by all documents read in this process,
+    opened again when the pack has been written to
+    '''
+    mtime = os.path.getmtime(corenlp_pack.index_path(path))
+    cached = _pack_readers.get(path)
+    if cached is None or cached[0] != mtime:
+        if cached is not None:
+            cached[1].close()
+        cached = _pack_readers[path] = (mtime, corenlp_pack.PackReader(path))
+    return cached[1]
+
+
+def _open_store(path):
+    '''
+    A corenlp.store.Store of path shared by all documents read in this
+    process, opened again when the store has been rebuilt
+    '''
+    mtime = os.path.getmtime(os.path.join(path, 'meta.pickle'))
+    cached = _stores.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _stores[path] = (mtime, corenlp_store.Store(path))
+    return cached[1]
+
+
+def _encode_sentences(sents, encoding, errors):
+    '''
+    Encode the rendered text of sents. errors is a codec error handler
+    ('strict', 'replace', 'xmlcharrefreplace'...), which encodes every
+    sentence in one pass, or 'drop' to leave out the sentences that cannot
+    be encoded, which needs a try per sentence. Returns the encoded strings
+    and the number of sentences left out.
+    '''
+    if errors != 'drop':
+        return [sent.encode(encoding, errors) for sent in sents], 0
+    encoded = []
+    for sent in sents:
+        try:
+            encoded.append(sent.encode(encoding))
+        except UnicodeEncodeError:
+            pass
+    return encoded, len(sents) - len(encoded)
+
+
+def _doc_rows_with_doc(args):
+    '''
+    _doc_rows together with the document it was called for
+    '''
+    return args[1], _doc_rows(args)
@@ -0,0 +1,81 @@
+'''
+Compare DocAnnotation.find_candidate_mentions with the original nested
+loop implementation on synthetic documents.
+
+    cd code && python -m benchmarks.mentions
+'''
+import argparse
+import StringIO
+import timeit
+
+import corenlp
+
+import data
+from annot import DocAnnotation
+from benchmarks import synthetic
+
+
+def legacy_find_candidate_mentions(doc, year):
+    '''
+    find_candidate_mentions before the CandidateMatcher: every name of
+    every party is compared with every mention head of every chain.
+    '''
+    can = data.candidates[year]
+    candidate_mentions = {party: set() for party in data.parties}
+    for chain in doc.mention_chains:
+        for party, names in can.items():
+            if any(name.lower() == t.lem.lower()
+                   for t in chain.mention_heads
+                   for name in names):
+                for t in chain.mention_heads:
+                    candidate_mentions[party].add(t.sent)
+    return candidate_mentions
+
+
+def synthetic_annotations(n_docs, year, **kwargs):
+    annots = []
+    for seed in range(n_docs):
+        xml = synthetic.corenlp_xml(year=year, parse=False, deps=False,
+                                    seed=seed, **kwargs)
+        annot = DocAnnotation.__new__(DocAnnotation)
+        annot.doc = corenlp.Document(StringIO.StringIO(xml), parse=False,
+                                     coll_ccp_deps=False)
+        annot.year, annot.debate, annot.doc_id = year, 1, seed
+        annots.append(annot)
+    return annots
+
+
+def run(n_docs=20, year=2000, n_sents=100, n_chains=200, repeat=5):
+    annots = synthetic_annotations(n_docs, year, n_sents=n_sents,
+                                   n_chains=n_chains)
+
+    def legacy():
+        for annot in annots:
+            legacy_find_candidate_mentions(annot.doc, year)
+
+    def matcher():
+        for annot in annots:
+            annot.find_candidate_mentions()
+
+    results = {}
+    for name, func in [('legacy', legacy), ('matcher', matcher)]:
+        results[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--year', type=int, default=2000)
+    parser.add_argument('--sents', type=int, default=100)
+    parser.add_argument('--chains', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    results = run(args.docs, args.year, args.sents, args.chains, args.repeat)
+    for name in ['legacy', 'matcher']:
+        print '%-8s %8.4fs' % (name, results[name])
+    print 'speedup  %8.2fx' % (results['legacy'] / results['matcher'])
+
+
+if __name__ == '__main__':
+    main()
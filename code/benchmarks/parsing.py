@@ -0,0 +1,77 @@
+'''
+Compare the parsing engines of corenlp.Document on a synthetic document,
+after checking that they produce the same tokens, sentences and chains.
+
+    cd code && python -m benchmarks.parsing
+'''
+import argparse
+import StringIO
+import timeit
+
+import corenlp
+
+from benchmarks import synthetic
+
+engines = ['iterparse', 'etree', 'lxml']
+
+
+def snapshot(doc):
+    '''
+    Everything a parsing engine produces, in comparable form
+    '''
+    columns = doc.columns
+    return (columns.vocab.strings,
+            [list(getattr(columns, name)) for name in
+             ['surface', 'lemma', 'pos', 'ner', 'begin', 'end']],
+            [(s._start, s._end, s._raw_parse(), s._raw_deps('basic'),
+              s._raw_deps('coll'), s._raw_deps('coll_ccp'), s.idx,
+              s.sentiment, s.sentiment_value) for s in doc.sents],
+            sorted(tuple((t.sent.idx, t.idx) for t in chain.mention_heads) +
+                   tuple((ts[0].sent.idx, ts[0].idx, len(ts))
+                         for ts in chain.mention_tokens if ts)
+                   for chain in doc.mention_chains))
+
+
+def available_engines():
+    try:
+        import lxml
+    except ImportError:
+        return [engine for engine in engines if engine != 'lxml']
+    return engines
+
+
+def run(n_sents=2000, n_tokens=25, n_chains=200, repeat=3, **options):
+    xml = synthetic.corenlp_xml(n_sents=n_sents, n_tokens=n_tokens,
+                                n_chains=n_chains)
+
+    def parse(engine):
+        return corenlp.Document(StringIO.StringIO(xml), engine=engine,
+                                **options)
+
+    reference = snapshot(parse('iterparse'))
+    results = {}
+    for engine in available_engines():
+        if snapshot(parse(engine)) != reference:
+            raise AssertionError('%s differs from iterparse' % engine)
+        results[engine] = min(timeit.repeat(lambda: parse(engine), number=1,
+                                            repeat=repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sents', type=int, default=2000)
+    parser.add_argument('--tokens', type=int, default=25)
+    parser.add_argument('--chains', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--basic-deps', action='store_true')
+    args = parser.parse_args()
+    results = run(args.sents, args.tokens, args.chains, args.repeat,
+                  basic_deps=args.basic_deps)
+    for engine in available_engines():
+        print '%-10s %8.4fs %8.2fx' % (engine, results[engine],
+                                       results['iterparse'] / results[engine])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+'''
+Time the hot paths of the pipeline on synthetic data and compare the
+results with a stored baseline.
+
+    cd code && python -m benchmarks.run --output results.json
+    cd code && python -m benchmarks.run --save-baseline
+    cd code && python -m benchmarks.run --stages parse,mentions
+
+Stages:
+
+- parse: corenlp.Document on CoreNLP XML files (no sidecar cache)
+- mentions: DocAnnotation.find_candidate_mentions on parsed documents
+- process_file: ArticleParser.parse_file on a LexisNexis export
+- final_output: ArticleParser.final_output from XML files to a CSV file
+
+Each stage runs in its own process, so that its peak RSS is not hidden by
+the stages before it. The results file records, for every stage, the best
+of `repeat` wall clock times, the throughput in the stage's unit and the
+peak RSS in kilobytes. Everything runs offline: the input is generated by
+benchmarks.synthetic and CoreNLP is not needed.
+'''
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import corenlp
+
+from annot import DocAnnotation
+from article_parser import ArticleParser
+from benchmarks import synthetic
+
+_default_baseline = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+defaults = {'docs': 20,
+            'sents': 100,
+            'tokens': 25,
+            'chains': 50,
+            'mentions_per_chain': 4,
+            'words': 400,
+            'export_docs': 1000,
+            'year': 2008,
+            'repeat': 3}
+
+
+def _write_xml_files(config, directory):
+    '''
+    Write config['docs'] synthetic CoreNLP files named like CoreNLP output
+    for the documents of debate 1. Returns their paths.
+    '''
+    paths = []
+    for doc_id in range(1, config['docs'] + 1):
+        path = os.path.join(directory, '%d_1_%03d.txt.xml' %
+                            (config['year'], doc_id))
+        with open(path, 'wb') as handle:
+            handle.write(synthetic.corenlp_xml(
+                n_sents=config['sents'], n_tokens=config['tokens'],
+                n_chains=config['chains'],
+                mentions_per_chain=config['mentions_per_chain'],
+                year=config['year'], seed=doc_id))
+        paths.append(path)
+    return paths
+
+
+def _parse_stage(config, workdir):
+    paths = _write_xml_files(config, workdir)
+    n_tokens = 0
+    for path in paths:
+        n_tokens += len(corenlp.Document(path, parse=False,
+                                         coll_ccp_deps=False).columns)
+
+    def run():
+        for path in paths:
+            corenlp.Document(path)
+    return run, n_tokens, 'tokens'
+
+
+def _mentions_stage(config, workdir):
+    paths = _write_xml_files(config, workdir)
+    annots = []
+    for doc_id, path in enumerate(paths, 1):
+        annot = DocAnnotation.__new__(DocAnnotation)
+        annot.doc = corenlp.Document(path, parse=False, coll_ccp_deps=False)
+        annot.year, annot.debate, annot.doc_id = config['year'], 1, doc_id
+        annots.append(annot)
+
+    def run():
+        for annot in annots:
+            annot.find_candidate_mentions()
+    return run, sum(len(annot.doc) for annot in annots), 'sentences'
+
+
+def _process_file_stage(config, workdir):
+    path = os.path.join(workdir, '%d presidential debate 1.txt' %
+                        config['year'])
+    with open(path, 'wb') as handle:
+        handle.write(synthetic.lexisnexis_export(
+            n_docs=config['export_docs'], n_words=config['words'],
+            year=config['year']))
+    parser = ArticleParser(workdir, None, None, None, None)
+    metadata = {'year': str(config['year']), 'debate_number': '1'}
+
+    def run():
+        parser.parse_file(path, metadata)
+    return run, config['export_docs'], 'documents'
+
+
+def _final_output_stage(config, workdir):
+    _write_xml_files(config, workdir)
+    parser = ArticleParser(None, workdir, None, None, None)
+    parser.docs = [{'year': str(config['year']), 'debate_number': '1',
+                    'doc_id': str(doc_id), 'publication': 'Synthetic',
+                    'byline': 'Reporter'}
+                   for doc_id in range(1, config['docs'] + 1)]
+    output_file = os.path.join(workdir, 'sentences.csv')
+
+    def run():
+        # Start from the XML every time rather than from the sidecar
+        # caches written by the previous run
+        for path in glob.glob(os.path.join(workdir, '*.cache')):
+            os.remove(path)
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            parser.final_output(output_file)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return run, config['docs'], 'documents'
+
+
+stages = [('parse', _parse_stage),
+          ('mentions', _mentions_stage),
+          ('process_file', _process_file_stage),
+          ('final_output', _final_output_stage)]
+
+
+def _run_stage(args):
+    '''
+    Set up and time one stage. Runs in a fresh worker process.
+    '''
+    name, config = args
+    workdir = tempfile.mkdtemp(prefix='benchmark_%s_' % name)
+    try:
+        run, n_items, unit = dict(stages)[name](config, workdir)
+        times = []
+        for _ in range(config['repeat']):
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+    finally:
+        shutil.rmtree(workdir)
+    best = min(times)
+    return {'seconds': best,
+            'runs': times,
+            'items': n_items,
+            'unit': unit,
+            'throughput': n_items / best if best > 0 else None,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def run(config=None, names=None):
+    '''
+    Run the stages in names (all by default) with config (see defaults)
+    and return the results as a JSON-serializable dict.
+    '''
+    config = dict(defaults, **(config or {}))
+    names = names or [name for name, _ in stages]
+    results = {'config': config,
+               'python': platform.python_version(),
+               'machine': platform.machine(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'stages': {}}
+    for name in names:
+        pool = multiprocessing.Pool(1)
+        try:
+            results['stages'][name] = pool.apply(_run_stage, ((name, config),))
+        finally:
+            pool.terminate()
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+    Return a list of messages, one per stage of results that is slower or
+    uses more memory than in baseline by more than the fraction tolerance.
+    '''
+    regressions = []
+    for name, stage in sorted(results['stages'].items()):
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        for key, label in [('seconds', 'time'), ('peak_rss_kb', 'peak RSS')]:
+            if stage[key] > base[key] * (1 + tolerance):
+                regressions.append('%s: %s %.4g -> %.4g (+%.0f%%)' %
+                                   (name, label, base[key], stage[key],
+                                    100.0 * (stage[key] / base[key] - 1)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    for key, value in sorted(defaults.items()):
+        parser.add_argument('--' + key.replace('_', '-'), type=int,
+                            default=value, dest=key)
+    parser.add_argument('--stages', default=None,
+                        help='comma separated stages to run, all by default')
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=_default_baseline,
+                        help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown as a fraction of the baseline')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    config = dict((key, getattr(args, key)) for key in defaults)
+    names = args.stages.split(',') if args.stages else None
+    results = run(config, names)
+
+    for name, _ in stages:
+        if name in results['stages']:
+            stage = results['stages'][name]
+            print '%-13s %8.4fs %12.0f %s/s %8d KB' % (
+                name, stage['seconds'], stage['throughput'] or 0,
+                stage['unit'], stage['peak_rss_kb'])
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+        return
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    if baseline['config'] != results['config']:
+        print 'baseline was run with a different configuration: %s' % (
+            args.baseline)
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+        print 'REGRESSION', message
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Synthetic CoreNLP output for benchmarks, so that they run without
+CoreNLP or the LexisNexis data.
+'''
+import random
+from xml.sax.saxutils import escape
+
+import data
+
+_filler = [('the', 'the', 'DT', 'O'), ('said', 'say', 'VBD', 'O'),
+           ('tax', 'tax', 'NN', 'O'), ('plan', 'plan', 'NN', 'O'),
+           ('he', 'he', 'PRP', 'O'), ('debate', 'debate', 'NN', 'O'),
+           ('voters', 'voter', 'NNS', 'O'), ('on', 'on', 'IN', 'O'),
+           ('Tuesday', 'Tuesday', 'NNP', 'DATE'), (',', ',', ',', 'O'),
+           ('-LRB-', '-lrb-', '-LRB-', 'O'), ('-RRB-', '-rrb-', '-RRB-', 'O')]
+
+
+def corenlp_xml(n_sents=50, n_tokens=25, n_chains=20, mentions_per_chain=4,
+                year=2008, parse=True, deps=True, seed=0):
+    '''
+    Return a CoreNLP XML document (as a UTF-8 byte string) with n_sents
+    sentences of about n_tokens tokens each and n_chains coreference
+    chains. Candidate names of `year` are mixed into the text so that
+    some of the chains mention candidates.
+    '''
+    rng = random.Random(seed)
+    names = [name for party_names in data.candidates[year].values()
+             for name in party_names]
+    vocab = list(_filler)
+    for name in names:
+        for word in name.split():
+            vocab.append((word.capitalize(), word, 'NNP', 'PERSON'))
+
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<root><document><sentences>']
+    offset = 0
+    lengths = []
+    for s in range(n_sents):
+        n = max(1, n_tokens + rng.randint(-n_tokens // 3, n_tokens // 3))
+        lengths.append(n)
+        out.append('<sentence id="%d"><tokens>' % (s + 1))
+        for i in range(n):
+            word, lemma, pos, ner = rng.choice(vocab)
+            length = 1 if word.startswith('-') else len(word)
+            out.append('<token id="%d"><word>%s</word><lemma>%s</lemma>'
+                       '<CharacterOffsetBegin>%d</CharacterOffsetBegin>'
+                       '<CharacterOffsetEnd>%d</CharacterOffsetEnd>'
+                       '<POS>%s</POS><NER>%s</NER></token>' %
+                       (i + 1, escape(word), escape(lemma), offset,
+                        offset + length, pos, ner))
+            offset += length + 1
+        out.append('</tokens>')
+        if parse:
+            leaves = ' '.join('(NN w%d)' % i for i in range(n))
+            out.append('<parse>(ROOT (S (NP %s)))</parse>' % leaves)
+        if deps:
+            for dtype in ('basic-dependencies', 'collapsed-dependencies',
+                          'collapsed-ccprocessed-dependencies'):
+                out.append('<dependencies type="%s">' % dtype)
+                out.append('<dep type="root"><governor idx="0">ROOT'
+                           '</governor><dependent idx="1">w</dependent></dep>')
+                for i in range(2, n + 1):
+                    out.append('<dep type="dep"><governor idx="%d">w'
+                               '</governor><dependent idx="%d">w</dependent>'
+                               '</dep>' % (rng.randint(1, n), i))
+                out.append('</dependencies>')
+        out.append('</sentence>')
+    out.append('</sentences><coreference>')
+    for c in range(n_chains):
+        out.append('<coreference>')
+        for m in range(mentions_per_chain):
+            s = rng.randrange(n_sents)
+            start = rng.randrange(lengths[s])
+            end = rng.randint(start + 1, min(lengths[s], start + 4))
+            head = rng.randint(start, end - 1)
+            out.append('<mention%s><sentence>%d</sentence><start>%d</start>'
+                       '<end>%d</end><head>%d</head></mention>' %
+                       (' representative="true"' if m == 0 else '', s + 1,
+                        start + 1, end + 1, head + 1))
+        out.append('</coreference>')
+    out.append('</coreference></document></root>\n')
+    return ''.join(out)
+
+
+def lexisnexis_export(n_docs=100, n_words=400, year=2008, seed=0):
+    '''
+    Return the text of a LexisNexis export with n_docs documents of about
+    n_words words each, in the layout ArticleParser.process_file expects.
+    '''
+    rng = random.Random(seed)
+    words = [word for word, _, _, _ in _filler if not word.startswith('-')]
+    words += [name.capitalize() for party_names in
+              data.candidates[year].values() for name in party_names]
+    out = ['Copyright 2015 LexisNexis\r\n\r\n']
+    for i in range(1, n_docs + 1):
+        text = ' '.join(rng.choice(words) for _ in
+                        range(max(1, n_words + rng.randint(-n_words // 2,
+                                                           n_words // 2))))
+        sections = ['The Daily Newspaper %d' % rng.randint(1, 20),
+                    'October %d, %d Thursday' % (rng.randint(1, 28), year),
+                    'Candidates spar in debate %d' % i,
+                    'BYLINE: Reporter %d' % rng.randint(1, 50),
+                    'SECTION: NEWS; Pg. A%d' % rng.randint(1, 30),
+                    'LENGTH: %d words' % n_words,
+                    text,
+                    'LOAD-DATE: October %d, %d' % (rng.randint(1, 28), year),
+                    'LANGUAGE: ENGLISH']
+        out.append('                  %d of %d DOCUMENTS\r\n\r\n' %
+                   (i, n_docs))
+        out.append('\r\n\r\n'.join(sections))
+        out.append('\r\n\r\n')
+    return ''.join(out)
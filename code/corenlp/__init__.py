@@ -1,22 +1,135 @@
+import functools
+import operator
 import xml.etree.cElementTree as ET
-import nltk
+from array import array
+from bisect import bisect_right
 from collections import defaultdict
 
-class Document:
+import numpy
+
+import cache as _cache
+
+_spaces = [u' ' * n for n in range(16)]
+
+
+class Vocabulary(object):
+    """
+    Interned strings. Token attributes are stored as ids into a
+    Vocabulary, which can be shared by many documents. Id 0 is None.
+    """
+    def __init__(self):
+        self.strings = [None]
+        self.ids = {None: 0}
+
+    def id(self, string):
+        try:
+            return self.ids[string]
+        except KeyError:
+            i = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            return i
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class TokenColumns(object):
+    """
+    The tokens of a document stored column by column: surface, lemma, POS
+    and NER as Vocabulary ids and character offsets as integers (-1 for
+    None). Token and Sentence objects are views over these arrays.
+    """
+    def __init__(self, vocab=None):
+        if vocab is None:
+            vocab = Vocabulary()
+        self.vocab = vocab
+        self.surface = array('i')
+        self.lemma = array('i')
+        self.pos = array('i')
+        self.ner = array('i')
+        self.begin = array('i')
+        self.end = array('i')
+
+    def append(self, surface, lemma, pos, ner, begin, end):
+        vocab_id = self.vocab.id
+        self.surface.append(vocab_id(surface))
+        self.lemma.append(vocab_id(lemma))
+        self.pos.append(vocab_id(pos))
+        self.ner.append(vocab_id(ner))
+        self.begin.append(-1 if begin is None else begin)
+        self.end.append(-1 if end is None else end)
+
+    def __len__(self):
+        return len(self.surface)
+
+
+class Document(object):
     def __init__(self, xmlfile, pos=True, lemma=True, ner=True, parse=True,
                  coref=True, basic_deps=False, coll_deps=False,
-                 coll_ccp_deps=True, verbose=False):
-
-        sents, coref_chains = _parse_source(xmlfile, use_pos=pos,
-                                            use_lemma=lemma, use_ner=ner,
-                                            use_parse=parse, use_coref=coref,
-                                            use_basic_deps=basic_deps,
-                                            use_coll_deps=coll_deps,
-                                            use_coll_ccp_deps=coll_ccp_deps,
-                                            verbose=verbose)
+                 coll_ccp_deps=True, verbose=False, cache=False, vocab=None,
+                 engine='iterparse'):
+        """
+        xmlfile -- Path to a CoreNLP XML file.
+        cache -- If True, read the document from a binary sidecar next to
+                 xmlfile when one exists for the same file contents and
+                 options, and write one after parsing otherwise.
+        vocab -- A Vocabulary to intern token strings in, e.g. one shared
+                 by all documents of a corpus.
+        engine -- 'iterparse' (the reference parser), 'fast' (the bulk
+                  parser of corenlp.fastparse, on lxml if it is installed),
+                  'lxml' or 'etree' (the bulk parser on cElementTree).
+        """
+        options = (pos, lemma, ner, parse, coref, basic_deps, coll_deps,
+                   coll_ccp_deps)
+        self.columns = TokenColumns(vocab)
+        sents = coref_chains = None
+        if cache:
+            payload = _cache.read(xmlfile, options)
+            if payload is not None:
+                sents, coref_chains = _unpack_document(payload, self.columns)
+
+        if sents is None:
+            sents, coref_chains = _parse_options(xmlfile, self.columns,
+                                                 options, verbose, engine)
+            if cache:
+                _cache.write(xmlfile, options,
+                             _pack_document(self.columns, sents,
+                                            coref_chains))
+
+        self._setup(sents, coref_chains)
+
+    @classmethod
+    def from_payload(cls, payload, vocab=None):
+        """
+        Rebuild a Document from the result of pack_document, interning its
+        strings in vocab.
+        """
+        columns = TokenColumns(vocab)
+        sents, coref_chains = _unpack_document(payload, columns)
+        return cls._from_parts(columns, sents, coref_chains)
+
+    @classmethod
+    def _from_parts(cls, columns, sents, coref_chains):
+        """
+        Build a Document from already parsed token columns, sentences and
+        mention chains, e.g. read from an annotation store.
+        """
+        doc = cls.__new__(cls)
+        doc.columns = columns
+        doc._setup(sents, coref_chains)
+        return doc
+
+    def _setup(self, sents, coref_chains):
         self.sents = sents
-        self.coref_map = self._build_coref_map(coref_chains)
-        self.mention_chains = set(self.coref_map.values())
+        self._mention_strings = {}
+        self._coref_map = None
+        self._build_coref_index(coref_chains)
+        self._chains = dict((chain_id, MentionChain(self, chain_id))
+                            for chain_id in set(self._segment_chain))
+        self.mention_chains = set(self._chains.values())
 
     def rep_head(self, token):
         """
@@ -26,7 +139,7 @@ class Document:
 
         token -- A Token object.
         """
-        mention_chain = self.coref_map.get(token, None)
+        mention_chain = self.mention_chain(token)
         if mention_chain is None:
             return token
         else:
@@ -39,19 +152,107 @@ class Document:
 
         token - A Token object.
         """
-        return self.coref_map.get(token, None)
+        if token._columns is not self.columns:
+            return None
+        i = bisect_right(self._segment_start, token._i) - 1
+        if i < 0 or token._i >= self._segment_end[i]:
+            return None
+        return self._chains[self._segment_chain[i]]
+
+    @property
+    def coref_map(self):
+        """
+        Dict from every token in a mention to its MentionChain, built on
+        first access. mention_chain() does the same lookup without it.
+        """
+        if self._coref_map is None:
+            starts = [sent._start for sent in self.sents]
+            coref_map = {}
+            for start, end, chain_id in zip(self._segment_start,
+                                            self._segment_end,
+                                            self._segment_chain):
+                chain = self._chains[chain_id]
+                sent = self.sents[bisect_right(starts, start) - 1]
+                for i in xrange(start, end):
+                    token = Token._view(self.columns, i, sent, i - sent._start)
+                    coref_map[token] = chain
+            self._coref_map = coref_map
+        return self._coref_map
 
-    def _build_coref_map(self, coref_chains):
-        coref_map = {}
-        for chain in coref_chains:
-            entity = MentionChain(chain, self)
+    def _build_coref_index(self, coref_chains):
+        """
+        Store the mentions of coref_chains as flat arrays (chain id,
+        sentence, start, end, head), where the mentions of chain c are
+        those from _chain_ptr[c] to _chain_ptr[c + 1], and index the
+        tokens they cover as sorted, disjoint intervals of rows of
+        self.columns, each belonging to one chain. A token in several
+        mentions belongs to the chain of the last one.
+        """
+        self._chain_ptr = array('i', [0])
+        self._mention_chain = array('i')
+        self._mention_sent = array('i')
+        self._mention_start = array('i')
+        self._mention_end = array('i')
+        self._mention_head = array('i')
+        for chain_id, chain in enumerate(coref_chains):
             for mention in chain:
-                sent = mention.sent
-                start = mention.start
-                end = mention.end
-                for token in self[sent][start:end]:
-                    coref_map[token] = entity 
-        return coref_map
+                self._mention_chain.append(chain_id)
+                self._mention_sent.append(mention.sent)
+                self._mention_start.append(mention.start)
+                self._mention_end.append(mention.end)
+                self._mention_head.append(mention.head)
+            self._chain_ptr.append(len(self._mention_chain))
+
+        rows, owner = self._covered_rows()
+        chains = _as_numpy(self._mention_chain)[owner]
+        if len(rows):
+            # A new interval starts wherever the rows stop being
+            # consecutive or the chain changes
+            first = numpy.ones(len(rows), dtype=bool)
+            first[1:] = (numpy.diff(rows) != 1) | (numpy.diff(chains) != 0)
+            last = numpy.ones(len(rows), dtype=bool)
+            last[:-1] = first[1:]
+            rows_first, rows_last = rows[first], rows[last] + 1
+            chains = chains[first]
+        else:
+            rows_first = rows_last = rows
+        self._segment_start = array('i', rows_first.tolist())
+        self._segment_end = array('i', rows_last.tolist())
+        self._segment_chain = array('i', chains.tolist())
+
+    def _covered_rows(self):
+        """
+        The sorted rows of self.columns covered by a mention, and the
+        index of the last mention covering each. Mention spans are clipped
+        to their sentence like slices of it.
+        """
+        n_mentions = len(self._mention_sent)
+        if n_mentions == 0 or not self.sents:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return empty, empty
+        sent_start = numpy.array([sent._start for sent in self.sents])
+        sent_len = numpy.array([len(sent) for sent in self.sents])
+        sent = _as_numpy(self._mention_sent)
+        offset, length = sent_start[sent], sent_len[sent]
+
+        def clip(index):
+            index = _as_numpy(index).astype(int)
+            index = numpy.where(index < 0, index + length, index)
+            return numpy.clip(index, 0, length)
+
+        start = clip(self._mention_start)
+        n_rows = numpy.maximum(clip(self._mention_end) - start, 0)
+        total = n_rows.sum()
+        # Row r of mention m for every (m, r), mentions in order
+        mention = numpy.repeat(numpy.arange(n_mentions), n_rows)
+        rows = (numpy.arange(total) -
+                numpy.repeat(numpy.cumsum(n_rows) - n_rows, n_rows) +
+                numpy.repeat(offset + start, n_rows))
+        order = numpy.lexsort((mention, rows))
+        rows, mention = rows[order], mention[order]
+        last = numpy.ones(total, dtype=bool)
+        last[:-1] = rows[1:] != rows[:-1]
+        return rows[last], mention[last]
 
     def __len__(self):
         return len(self.sents)
@@ -60,51 +261,178 @@ class Document:
         return self.sents[index]
 
     def mention_string(self, mention):
-        tokens = []
-        sent = mention.sent
-        start = mention.start
-        end = mention.end
-        for t in self.sents[sent].tokens[start:end]:
-            tokens.append(t._surface)
-        return u' '.join(tokens)
+        """
+        The surface strings of the mention's tokens joined by spaces,
+        memoized by span.
+        """
+        key = (mention.sent, mention.start, mention.end)
+        try:
+            return self._mention_strings[key]
+        except KeyError:
+            pass
+        sent = self.sents[mention.sent]
+        offset = sent._start
+        start, end, _ = slice(mention.start, mention.end).indices(len(sent))
+        strings = sent._columns.vocab.strings
+        ids = sent._columns.surface[offset + start:offset + max(start, end)]
+        string = self._mention_strings[key] = u' '.join([strings[i]
+                                                         for i in ids])
+        return string
+
+    def __unicode__(self):
+        return u'\n'.join([unicode(s) for s in self.sents])
 
     def __str__(self):
-        return u'\n'.join([unicode(s) for s in self.sents])        
+        return self.__unicode__()
+
+
+class Sentence(object):
+    __slots__ = ('_columns', '_start', '_end', '_parse', '_deps', '_dgraph',
+                 '_string', 'idx', 'sentiment', 'sentiment_value')
 
-class Sentence:
-    def __init__(self, tokens, parse,
+    def __init__(self, columns, start, end, parse,
                  basic_deps, collapsed_deps, collapsed_ccproc_deps, idx,
                  sentiment, sentiment_value):
-        self.tokens = tuple(tokens)
-        self.parse = parse
-        self.basic_deps = basic_deps
-        self.coll_deps = collapsed_deps
-        self.coll_ccp_deps = collapsed_ccproc_deps
-        if collapsed_ccproc_deps is not None:
-            self.deps = collapsed_ccproc_deps
-        elif collapsed_deps is not None:
-            self.deps = collapsed_deps
-        elif basic_deps is not None:
-            self.deps = basic_deps
-        else:
-            self.deps = None
+        """
+        columns, start, end -- The sentence's tokens are rows start to end
+                 of a TokenColumns.
+        parse -- An nltk Tree, or its bracketed string, which is converted
+                 to a Tree on first access of self.parse.
+        basic_deps, collapsed_deps, collapsed_ccproc_deps -- Lists of
+                 TypedDependency, or tuples of (dependent index, governor
+                 index, type) triples as produced by the parser, which are
+                 converted to lists of TypedDependency on first access.
+        """
+        self._columns = columns
+        self._start = start
+        self._end = end
+        self._parse = parse
+        self._deps = {'basic': basic_deps,
+                      'coll': collapsed_deps,
+                      'coll_ccp': collapsed_ccproc_deps}
         self._dgraph = None
+        self._string = None
         self.idx = idx
         self.sentiment = sentiment
         self.sentiment_value = sentiment_value
 
+    @property
+    def tokens(self):
+        return tuple(Token._view(self._columns, i, self, i - self._start)
+                     for i in xrange(self._start, self._end))
+
+    @property
+    def parse(self):
+        if isinstance(self._parse, basestring):
+            import nltk
+            self._parse = nltk.tree.Tree.fromstring(self._parse)
+        return self._parse
+
+    @parse.setter
+    def parse(self, parse):
+        self._parse = parse
+
+    @property
+    def basic_deps(self):
+        return self._get_deps('basic')
+
+    @basic_deps.setter
+    def basic_deps(self, deps):
+        self._deps['basic'] = deps
+
+    @property
+    def coll_deps(self):
+        return self._get_deps('coll')
+
+    @coll_deps.setter
+    def coll_deps(self, deps):
+        self._deps['coll'] = deps
+
+    @property
+    def coll_ccp_deps(self):
+        return self._get_deps('coll_ccp')
+
+    @coll_ccp_deps.setter
+    def coll_ccp_deps(self, deps):
+        self._deps['coll_ccp'] = deps
+
+    @property
+    def deps(self):
+        for kind in ('coll_ccp', 'coll', 'basic'):
+            if self._deps[kind] is not None:
+                return self._get_deps(kind)
+        return None
+
+    def _get_deps(self, kind):
+        deps = self._deps[kind]
+        if isinstance(deps, tuple):
+            deps = self._deps[kind] = _typed_dependencies(self.tokens, deps)
+        return deps
+
+    def _raw_deps(self, kind):
+        """
+        Dependencies of the given kind as (dependent index, governor index,
+        type) triples, without materializing them.
+        """
+        deps = self._deps[kind]
+        if deps is None or isinstance(deps, tuple):
+            return deps
+        return tuple((d.dep.idx if d.dep is not None else None, d.gov.idx,
+                      d.type) for d in deps)
+
+    def _raw_parse(self):
+        if self._parse is None or isinstance(self._parse, basestring):
+            return self._parse
+        return unicode(self._parse)
+
     def __getitem__(self, index):
-        return self.tokens[index]
+        if isinstance(index, slice):
+            return tuple(Token._view(self._columns, self._start + i, self, i)
+                         for i in xrange(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('token index out of range')
+        return Token._view(self._columns, self._start + index, self, index)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __unicode__(self):
+        """
+        The sentence's tokens separated by as many spaces as there are
+        characters between them in the original text. Rendered once and
+        memoized.
+        """
+        if self._string is None:
+            self._string = self._render()
+        return self._string
 
     def __str__(self):
-        tokstrings = []
-        prev_offset = self[0].char_offset_begin
-        for t in self.tokens:
-            space = u' ' * (t.char_offset_begin - prev_offset)
-            tokstrings.append(unicode(space))
-            tokstrings.append(t._surface)
-            prev_offset = t.char_offset_end
-        return u''.join(tokstrings)
+        return self.__unicode__()
+
+    def encode(self, encoding='utf-8', errors='strict'):
+        return self.__unicode__().encode(encoding, errors)
+
+    def _render(self):
+        columns = self._columns
+        start, end = self._start, self._end
+        if start == end:
+            return u''
+        strings = columns.vocab.strings
+        spaces = _spaces
+        n_spaces = len(spaces)
+        # Tokens interleaved with the gaps between them
+        pieces = [None] * (2 * (end - start) - 1)
+        pieces[::2] = [strings[i] for i in columns.surface[start:end]]
+        gaps = map(operator.sub, columns.begin[start + 1:end],
+                   columns.end[start:end - 1])
+        if gaps and (min(gaps) < 0 or max(gaps) >= n_spaces):
+            pieces[1::2] = [spaces[gap] if 0 <= gap < n_spaces
+                            else u' ' * gap for gap in gaps]
+        else:
+            pieces[1::2] = map(spaces.__getitem__, gaps)
+        return u''.join(pieces)
 
     def __repr__(self):
         return u'Sentence ({}) {}'.format(self.idx, unicode(self))
@@ -133,16 +461,67 @@ class Sentence:
 #        else:
 #            return self._attrs() == other._attrs()
 
-class Token:
+class Token(object):
+    """
+    A view of one row of a TokenColumns. Two views of the same row are
+    equal and hash alike, so tokens can be used as dictionary keys no
+    matter how they were obtained.
+    """
+    __slots__ = ('_columns', '_i', 'sent', 'idx')
+
     def __init__(self, surface, lem, pos, ner,
                  char_offset_begin, char_offset_end, idx):
-        self._surface = surface
-        self.lem = lem
-        self.pos = pos
-        self.ne = ner
+        self._columns = TokenColumns()
+        self._columns.append(surface, lem, pos, ner,
+                             char_offset_begin, char_offset_end)
+        self._i = 0
+        self.sent = None
         self.idx = idx
-        self.char_offset_begin = char_offset_begin
-        self.char_offset_end = char_offset_end
+
+    @classmethod
+    def _view(cls, columns, i, sent, idx):
+        token = cls.__new__(cls)
+        token._columns = columns
+        token._i = i
+        token.sent = sent
+        token.idx = idx
+        return token
+
+    @property
+    def _surface(self):
+        return self._columns.vocab.strings[self._columns.surface[self._i]]
+
+    @property
+    def lem(self):
+        return self._columns.vocab.strings[self._columns.lemma[self._i]]
+
+    @property
+    def pos(self):
+        return self._columns.vocab.strings[self._columns.pos[self._i]]
+
+    @property
+    def ne(self):
+        return self._columns.vocab.strings[self._columns.ner[self._i]]
+
+    @property
+    def char_offset_begin(self):
+        offset = self._columns.begin[self._i]
+        return None if offset < 0 else int(offset)
+
+    @property
+    def char_offset_end(self):
+        offset = self._columns.end[self._i]
+        return None if offset < 0 else int(offset)
+
+    def __eq__(self, other):
+        return (isinstance(other, Token) and self._i == other._i and
+                self._columns is other._columns)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._columns), self._i))
 
     def __len__(self):
         return len(self._surface)
@@ -212,27 +591,270 @@ class Mention:
                                                                     self.head,
                                                                     self.end)
 
-class MentionChain:
-    def __init__(self, mention_chain, doc):
-        mention_heads = []
-        mention_tokens = []                
-        for mention in mention_chain:
-            s = mention.sent
-            h = mention.head
-            start = mention.start
-            end = mention.end
-            mention_heads.append(doc[s][h])
-            mention_tokens.append(doc[s][start:end])
-        self.rep_head = mention_heads[0]
-        self.rep_tokens = mention_tokens[0]
-        self.mention_heads = tuple(mention_heads)
-        self.mention_tokens = tuple(mention_tokens)
+class MentionChain(object):
+    """
+    A coreference chain of a Document, read from the document's mention
+    arrays when its tokens are first asked for.
+    """
+    def __init__(self, doc, chain_id):
+        self._doc = doc
+        self._id = chain_id
+        self._heads = None
+        self._tokens = None
 
+    def _mentions(self):
+        doc = self._doc
+        lo, hi = doc._chain_ptr[self._id], doc._chain_ptr[self._id + 1]
+        return zip(doc._mention_sent[lo:hi], doc._mention_start[lo:hi],
+                   doc._mention_end[lo:hi], doc._mention_head[lo:hi])
 
-def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
-                  use_parse=True, use_coref=True, use_basic_deps=False,
-                  use_coll_deps=False, use_coll_ccp_deps=True, verbose=False):
+    @property
+    def mention_heads(self):
+        if self._heads is None:
+            doc = self._doc
+            self._heads = tuple(doc[s][h] for s, _, _, h in self._mentions())
+        return self._heads
+
+    @property
+    def mention_tokens(self):
+        if self._tokens is None:
+            doc = self._doc
+            self._tokens = tuple(doc[s][start:end]
+                                 for s, start, end, _ in self._mentions())
+        return self._tokens
+
+    @property
+    def rep_head(self):
+        return self.mention_heads[0]
+
+    @property
+    def rep_tokens(self):
+        return self.mention_tokens[0]
+
+
+def _as_numpy(ints):
+    """
+    A numpy view of an array('i')
+    """
+    if not ints:
+        return numpy.zeros(0, dtype=numpy.intc)
+    return numpy.frombuffer(ints, dtype=numpy.intc)
+
+
+def _typed_dependencies(tokens, raw_deps):
+    deps = []
+    for dep, gov, deptype in raw_deps:
+        if gov > -1:
+            governor = tokens[gov]
+        else:
+            governor = Token('ROOT', 'root', 'ROOT', None, None, None, -1)
+        dependent = tokens[dep] if dep is not None else None
+        deps.append(TypedDependency(dependent, governor, deptype))
+    return deps
+
+
+def _as_tuple(deps):
+    return None if deps is None else tuple(deps)
+
+
+def _pack_document(columns, sents, coref_chains):
+    """
+    Flatten the token columns, sentences and mention chains of a document
+    for the sidecar cache. Token strings are renumbered into a table
+    local to the document so that the cache does not depend on the
+    Vocabulary the document was parsed with.
+    """
+    strings = []
+    string_ids = {}
+    vocab_strings = columns.vocab.strings
+
+    def sid(s):
+        if s not in string_ids:
+            string_ids[s] = len(strings)
+            strings.append(s)
+        return string_ids[s]
+
+    def pack_column(column):
+        return array('i', [sid(vocab_strings[i]) for i in column]).tostring()
+
+    def pack_deps(deps):
+        if deps is None:
+            return None
+        return tuple((dep, gov, sid(deptype)) for dep, gov, deptype in deps)
 
+    packed_columns = (pack_column(columns.surface),
+                      pack_column(columns.lemma),
+                      pack_column(columns.pos),
+                      pack_column(columns.ner),
+                      columns.begin.tostring(),
+                      columns.end.tostring())
+    packed_sents = tuple((sent._start, sent._end, sent.idx, sent.sentiment,
+                          sent.sentiment_value, sent._raw_parse(),
+                          pack_deps(sent._raw_deps('basic')),
+                          pack_deps(sent._raw_deps('coll')),
+                          pack_deps(sent._raw_deps('coll_ccp')))
+                         for sent in sents)
+    packed_chains = tuple(tuple((m.start, m.end, m.head, m.sent)
+                                for m in chain)
+                          for chain in coref_chains)
+    return strings, packed_columns, packed_sents, packed_chains
+
+
+def _unpack_document(payload, columns):
+    """
+    Fill columns from a payload made by _pack_document and return the
+    sentences and mention chains.
+    """
+    strings, packed_columns, packed_sents, packed_chains = payload
+    surface, lemma, pos, ner, begin, end = packed_columns
+    ids = [columns.vocab.id(s) for s in strings]
+
+    def unpack_column(column, packed):
+        local = array('i')
+        local.fromstring(packed)
+        column.extend(array('i', [ids[i] for i in local]))
+
+    unpack_column(columns.surface, surface)
+    unpack_column(columns.lemma, lemma)
+    unpack_column(columns.pos, pos)
+    unpack_column(columns.ner, ner)
+    columns.begin.fromstring(begin)
+    columns.end.fromstring(end)
+
+    def unpack_deps(deps):
+        if deps is None:
+            return None
+        return tuple((dep, gov, strings[deptype])
+                     for dep, gov, deptype in deps)
+
+    sents = [Sentence(columns, start, stop, parse, unpack_deps(basic_deps),
+                      unpack_deps(coll_deps), unpack_deps(coll_ccp_deps),
+                      idx, sentiment, sentiment_value)
+             for (start, stop, idx, sentiment, sentiment_value, parse,
+                  basic_deps, coll_deps, coll_ccp_deps) in packed_sents]
+    chains = [[Mention(start, stop, head, sent)
+               for start, stop, head, sent in chain]
+              for chain in packed_chains]
+    return sents, chains
+
+
+def pack_document(xmlfile, pos=True, lemma=True, ner=True, parse=True,
+                  coref=True, basic_deps=False, coll_deps=False,
+                  coll_ccp_deps=True, verbose=False, cache=False,
+                  engine='iterparse'):
+    """
+    Parse a CoreNLP XML file like Document, but return it in the compact
+    form of the sidecar cache, e.g. to send it from a worker process.
+    Document.from_payload turns it back into a Document. With cache, a
+    valid sidecar is returned as is, without building the document.
+    """
+    options = (pos, lemma, ner, parse, coref, basic_deps, coll_deps,
+               coll_ccp_deps)
+    if cache:
+        payload = _cache.read(xmlfile, options)
+        if payload is not None:
+            return payload
+    columns = TokenColumns()
+    sents, coref_chains = _parse_options(xmlfile, columns, options, verbose,
+                                         engine)
+    payload = _pack_document(columns, sents, coref_chains)
+    if cache:
+        _cache.write(xmlfile, options, payload)
+    return payload
+
+
+def iter_sentences(xmlfile, pos=True, lemma=True, ner=True, parse=True,
+                   basic_deps=False, coll_deps=False, coll_ccp_deps=True,
+                   verbose=False, engine='iterparse'):
+    """
+    Yield the Sentence objects of a CoreNLP XML file one at a time.
+    Each <sentence> subtree is released once it has been converted, so
+    memory use is bounded by the size of a single sentence rather than
+    by the size of the document. Coreference is not resolved.
+
+    xmlfile -- A path or file object containing CoreNLP XML output.
+    engine -- See Document.
+    """
+    # Every sentence gets its own TokenColumns so that it can be freed
+    # independently of the others.
+    iter_parse = _engine(engine)
+    for kind, item in iter_parse(xmlfile, None, use_pos=pos, use_lemma=lemma,
+                                 use_ner=ner, use_parse=parse,
+                                 use_coref=False,
+                                 use_basic_deps=basic_deps,
+                                 use_coll_deps=coll_deps,
+                                 use_coll_ccp_deps=coll_ccp_deps,
+                                 verbose=verbose):
+        if kind == 'sentence':
+            yield item
+
+
+def _parse_options(source, columns, options, verbose, engine):
+    """
+    _parse_source with the options tuple of Document and the cache
+    """
+    (pos, lemma, ner, parse, coref, basic_deps, coll_deps,
+     coll_ccp_deps) = options
+    return _parse_source(source, columns, use_pos=pos, use_lemma=lemma,
+                         use_ner=ner, use_parse=parse, use_coref=coref,
+                         use_basic_deps=basic_deps, use_coll_deps=coll_deps,
+                         use_coll_ccp_deps=coll_ccp_deps, verbose=verbose,
+                         engine=engine)
+
+
+def _parse_source(source, columns, use_pos=True, use_lemma=True,
+                  use_ner=True, use_parse=True, use_coref=True,
+                  use_basic_deps=False, use_coll_deps=False,
+                  use_coll_ccp_deps=True, verbose=False, engine='iterparse'):
+
+    sents = []
+    mention_chains = []
+    iter_parse = _engine(engine)
+    for kind, item in iter_parse(source, columns, use_pos=use_pos,
+                                 use_lemma=use_lemma, use_ner=use_ner,
+                                 use_parse=use_parse, use_coref=use_coref,
+                                 use_basic_deps=use_basic_deps,
+                                 use_coll_deps=use_coll_deps,
+                                 use_coll_ccp_deps=use_coll_ccp_deps,
+                                 verbose=verbose):
+        if kind == 'sentence':
+            sents.append(item)
+        else:
+            mention_chains.append(item)
+    return sents, mention_chains
+
+
+def _engine(name):
+    """
+    The generator that implements the parsing engine name (see Document)
+    """
+    if name == 'iterparse':
+        return _iter_parse
+    import fastparse
+    if name == 'fast':
+        return fastparse.iter_parse
+    elif name == 'lxml':
+        return functools.partial(fastparse.iter_parse, use_lxml=True)
+    elif name == 'etree':
+        return functools.partial(fastparse.iter_parse, use_lxml=False)
+    raise ValueError('Unknown parsing engine: %r' % name)
+
+
+def _iter_parse(source, columns, use_pos=True, use_lemma=True, use_ner=True,
+                use_parse=True, use_coref=True, use_basic_deps=False,
+                use_coll_deps=False, use_coll_ccp_deps=True, verbose=False):
+    """
+    Generator behind _parse_source. Appends the tokens to columns and
+    yields ('sentence', Sentence) for every sentence and then ('coref',
+    [Mention, ...]) for every mention chain. If columns is None, every
+    sentence gets a TokenColumns of its own. Finished <sentence> and
+    <coreference> elements are cleared and detached from their parents so
+    the XML tree never grows beyond the element currently being read.
+    """
+    _fresh_columns = columns is None
+    if _fresh_columns:
+        _vocab = Vocabulary()
+        columns = TokenColumns(_vocab)
 
     # Temporary vars for token level attributes.
     _word = None
@@ -241,7 +863,6 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
     _ner = None
     _char_offset_begin = None
     _char_offset_end = None
-    _token_idx = 0
     _sent_idx = 0
 
     # Temporary vars for sentence level attributes.
@@ -249,27 +870,35 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
     _basic_deps = None
     _collapsed_deps = None
     _collapsed_ccproc_deps = None
-    _tokens = []
+    _sent_start = len(columns)
     _current_deps = None
 
     _governor = None
     _dependent = None
 
-    sents = []
-
     _not_in_coref = True
     _coref_start = None
     _coref_end = None
     _coref_head = None
     _coref_sentence = None
     _mentions = []
-    _mention_chains = []
+
+    # Parents of the subtrees we release as we go.
+    _sentences_elem = None
+    _coref_root = None
 
 
     for event, elem in ET.iterparse(source, events=('start', 'end')):
         if event == 'start':
-            if elem.tag == 'dependencies':
+            if elem.tag == 'sentences':
+                _sentences_elem = elem
+            elif elem.tag == 'coreference' and _coref_root is None:
+                _coref_root = elem
+            elif elem.tag == 'dependencies':
                 dtype = elem.attrib['type']
+                # Dependencies of a type that was not asked for are
+                # skipped rather than added to the previous type's list.
+                _current_deps = None
                 if dtype == 'collapsed-ccprocessed-dependencies':
                     if use_coll_ccp_deps:
                         _current_deps = _collapsed_ccproc_deps = []
@@ -279,8 +908,6 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
                 elif dtype == 'basic-dependencies':
                     if use_basic_deps:
                         _current_deps = _basic_deps = []
-                else:
-                    _current_deps = None
         else:
             if elem.tag == 'word':
                _word = unicode(elem.text)
@@ -312,9 +939,8 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
                     if _char_offset_end - _char_offset_begin == 1:
                         _word = '"'
 
-                _tokens.append(Token(_word, _lemma, _pos, _ner,
-                                     _char_offset_begin, _char_offset_end,
-                                     _token_idx))
+                columns.append(_word, _lemma, _pos, _ner,
+                               _char_offset_begin, _char_offset_end)
 
                 _word = None
                 _lemma = None
@@ -322,28 +948,23 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
                 _ner = None
                 _char_offset_begin = None
                 _char_offset_end = None
-                _token_idx += 1
 
             # Recover Parse Tree here.
             elif elem.tag == 'parse' and use_parse:
-                _parse = nltk.tree.Tree.fromstring(unicode(elem.text))
+                _parse = unicode(elem.text)
 
             # Recover dependencies here.
+            # Dependencies are kept as index triples; Sentence turns them
+            # into TypedDependency objects when they are first used.
             elif elem.tag == 'governor' and _current_deps is not None:
-                idx = int(elem.attrib['idx']) - 1
-                if idx > -1:
-                    _governor = _tokens[idx]
-                else:
-                    _governor = Token('ROOT', 'root', 'ROOT', None,
-                                      None, None, -1)
+                _governor = max(int(elem.attrib['idx']) - 1, -1)
             elif elem.tag == 'dependent' and _current_deps is not None:
                 idx = int(elem.attrib['idx']) - 1
                 if idx > -1:
-                    _dependent = _tokens[idx]
+                    _dependent = idx
             elif elem.tag == 'dep' and _current_deps is not None:
                 rel = unicode(elem.attrib['type'])
-                typed_dep = TypedDependency(_dependent, _governor, rel)
-                _current_deps.append(typed_dep)
+                _current_deps.append((_dependent, _governor, rel))
 
             # Recover coref chain here.
             elif elem.tag == 'start' and use_coref:
@@ -356,10 +977,13 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
                 _mentions.append(Mention(_coref_start, _coref_end,
                                          _coref_head, _coref_sentence))
 
-            elif elem.tag == 'coreference' and use_coref:
-                if len(_mentions) > 0:
-                    _mention_chains.append(_mentions)
+            elif elem.tag == 'coreference':
+                if use_coref and len(_mentions) > 0:
+                    yield 'coref', _mentions
                 _mentions = []
+                if elem is not _coref_root:
+                    elem.clear()
+                    _coref_root.remove(elem)
 
             elif elem.tag == 'sentence':
                 if _not_in_coref:
@@ -371,21 +995,25 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
                     if 'sentimentValue' in elem.attrib:
                         sentiment_val = float(elem.attrib['sentimentValue'])
                     
-                    sent = Sentence(_tokens, _parse, _basic_deps,
-                                    _collapsed_deps, _collapsed_ccproc_deps,
+                    sent = Sentence(columns, _sent_start, len(columns),
+                                    _parse, _as_tuple(_basic_deps),
+                                    _as_tuple(_collapsed_deps),
+                                    _as_tuple(_collapsed_ccproc_deps),
                                     _sent_idx, sentiment, sentiment_val)
-                    sents.append(sent)
 
-                    for token in _tokens:
-                        token.sent = sent
+                    elem.clear()
+                    if _sentences_elem is not None:
+                        _sentences_elem.remove(elem)
+                    yield 'sentence', sent
 
-                    _tokens = []
+                    if _fresh_columns:
+                        columns = TokenColumns(_vocab)
+                    _sent_start = len(columns)
                     _parse = None
                     _basic_deps = None
                     _collapsed_deps = None
                     _collapsed_ccproc_deps = None
                     _current_deps = None
-                    _token_idx = 0
                     _sent_idx += 1
 
                 else:
@@ -393,5 +1021,5 @@ def _parse_source(source, use_pos=True, use_lemma=True, use_ner=True,
 
             elif elem.tag == 'sentences':
                 _not_in_coref = False
-
-    return sents, _mention_chains
+                if not use_coref:
+                    return
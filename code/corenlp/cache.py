@@ -0,0 +1,107 @@
+"""
+Binary sidecar cache for parsed CoreNLP documents.
+
+A sidecar lives next to the XML file it was built from (foo.txt.xml ->
+foo.txt.xml.cache) and holds two pickles: a small header describing the
+XML file and the parse options, followed by the packed document itself.
+Only the header is read to decide whether the sidecar is still valid.
+"""
+import cPickle
+import hashlib
+import os
+
+_version = 3
+_extension = '.cache'
+
+
+def sidecar_path(xmlfile):
+    return xmlfile + _extension
+
+
+def read(xmlfile, options):
+    """
+    Return the payload cached for xmlfile, or None if there is no
+    sidecar or it was built from a different XML file or with different
+    parse options.
+    """
+    path = sidecar_path(xmlfile)
+    try:
+        handle = open(path, 'rb')
+    except IOError:
+        return None
+    with handle:
+        try:
+            header = cPickle.load(handle)
+        except Exception:
+            return None
+        if not _header_matches(header, xmlfile, options):
+            return None
+        try:
+            return cPickle.load(handle)
+        except Exception:
+            return None
+
+
+def write(xmlfile, options, payload):
+    """
+    Write payload to the sidecar of xmlfile. The sidecar is written to a
+    temporary file first so that concurrent readers never see a partial
+    cache. Returns False, leaving no sidecar, if it cannot be written
+    (e.g. the directory is read-only or full): a cache that cannot be
+    written must not fail the parse it would have saved.
+    """
+    path = sidecar_path(xmlfile)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as handle:
+            cPickle.dump(_header(xmlfile, options), handle,
+                         cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(payload, handle, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def _header(xmlfile, options):
+    st = os.stat(xmlfile)
+    return {'version': _version,
+            'options': options,
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'md5': md5_file(xmlfile)}
+
+
+def _header_matches(header, xmlfile, options):
+    if not isinstance(header, dict) or header.get('version') != _version:
+        return False
+    if header.get('options') != options:
+        return False
+    try:
+        st = os.stat(xmlfile)
+    except OSError:
+        return False
+    if st.st_size != header.get('size'):
+        return False
+    if st.st_mtime == header.get('mtime'):
+        return True
+    # The file was touched: only trust the cache if the content is the same.
+    return md5_file(xmlfile) == header.get('md5')
+
+
+def md5_file(filename, block_size=1 << 20):
+    """
+    The hex md5 digest of the contents of filename, read in blocks
+    """
+    digest = hashlib.md5()
+    with open(filename, 'rb') as handle:
+        while True:
+            block = handle.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,105 @@
+"""
+A stand-in for a CoreNLP server, for testing the client in server.py
+without Java or the CoreNLP models.
+
+    with FakeServer(fail_every=3) as fake:
+        server.files2dir(files, out_dir, url=fake.url)
+
+It answers every POST with canned CoreNLP XML: one sentence whose tokens
+are the whitespace-separated words of the text, so that an annotation can
+be matched with the text it was made from. With fail_every=n, every n-th
+request gets a 503 response instead, which the client should retry.
+"""
+import BaseHTTPServer
+import re
+import SocketServer
+import threading
+import time
+from xml.sax.saxutils import escape
+
+_token = ('<token id="%d"><word>%s</word><lemma>%s</lemma>'
+          '<CharacterOffsetBegin>%d</CharacterOffsetBegin>'
+          '<CharacterOffsetEnd>%d</CharacterOffsetEnd>'
+          '<POS>NN</POS><NER>O</NER></token>')
+
+
+def canned_xml(text):
+    """
+    CoreNLP XML (a UTF-8 byte string) with one sentence holding the words
+    of text (a UTF-8 byte string)
+    """
+    tokens = [_token % (i + 1, escape(match.group()),
+                        escape(match.group().lower()), match.start(),
+                        match.end())
+              for i, match in enumerate(re.finditer(r'\S+', text))]
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<root><document><sentences><sentence id="1"><tokens>%s'
+            '</tokens></sentence></sentences></document></root>\n' %
+            ''.join(tokens))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections alive, as the real server does
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        text = self.rfile.read(int(self.headers['Content-Length']))
+        fake = self.server.fake
+        if fake.delay:
+            time.sleep(fake.delay)
+        with fake._lock:
+            fake.requests += 1
+            fail = fake.fail_every and fake.requests % fake.fail_every == 0
+            if fail:
+                fake.failures += 1
+        if fail:
+            self._respond(503, 'Service Unavailable')
+        else:
+            self._respond(200, canned_xml(text))
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """
+    Serves canned XML on a free port of localhost in a background thread
+    until closed. requests and failures count the requests received and
+    those answered with a 503.
+    """
+
+    def __init__(self, fail_every=0, delay=0):
+        self.fail_every = fail_every
+        self.delay = delay
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._httpd = _HTTPServer(('localhost', 0), _Handler)
+        self._httpd.fake = self
+        self.url = 'http://localhost:%d' % self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,298 @@
+"""
+Bulk parsing engine for CoreNLP XML files.
+
+The reference engine (corenlp._iter_parse) handles every XML element as it
+is read, through a chain of tag comparisons. This engine only stops at the
+end of each <sentence> and <coreference> element and then pulls all of its
+fields at once:
+
+- the texts of a sentence's tokens are read row by row and transposed into
+  columns, using the position of each field in the first token when all
+  tokens have the same layout (the usual case);
+- surface, lemma, POS and NER strings are interned with a single lookup in
+  the document's Vocabulary, and every column is extended in one call;
+- only the dependency types that were asked for are read.
+
+With lxml installed, the XML parser itself skips the token elements and
+only reports the elements above; otherwise xml.etree.cElementTree is used.
+Both produce the same Sentence and Mention objects as the reference
+engine. Select it with corenlp.Document(xmlfile, engine='fast').
+"""
+import xml.etree.cElementTree as ET
+
+try:
+    from lxml import etree as _lxml
+except ImportError:
+    _lxml = None
+
+from corenlp import Mention, Sentence, TokenColumns, Vocabulary, _as_tuple
+
+_brackets = {'-LRB-': u'(', '-RRB-': u')', '-LCB-': u'{', '-RCB-': u'}',
+             '-LSB-': u'[', '-RSB-': u']'}
+_bracket_words = frozenset(_brackets)
+_quotes = ('``', "''")
+_text_fields = ['word', 'lemma', 'POS', 'NER']
+_offset_fields = ['CharacterOffsetBegin', 'CharacterOffsetEnd']
+_column_names = {'word': 'surface', 'lemma': 'lemma', 'POS': 'pos',
+                 'NER': 'ner'}
+_mention_fields = {'sentence': 0, 'start': 1, 'end': 2, 'head': 3}
+_dep_kinds = {'basic-dependencies': 'basic',
+              'collapsed-dependencies': 'coll',
+              'collapsed-ccprocessed-dependencies': 'coll_ccp'}
+_missing = object()
+
+if _lxml is not None:
+    _xpaths = dict((field, _lxml.XPath('token/%s/text()' % field,
+                                       smart_strings=False))
+                   for field in _text_fields + _offset_fields)
+
+
+def iter_parse(source, columns, use_pos=True, use_lemma=True, use_ner=True,
+               use_parse=True, use_coref=True, use_basic_deps=False,
+               use_coll_deps=False, use_coll_ccp_deps=True, verbose=False,
+               use_lxml=None):
+    """
+    Drop-in replacement for corenlp._iter_parse. use_lxml selects the XML
+    parser: lxml if True, cElementTree if False and lxml when it is
+    installed if None.
+    """
+    if use_lxml is None:
+        use_lxml = _lxml is not None
+    fresh_columns = columns is None
+    if fresh_columns:
+        vocab = Vocabulary()
+        columns = TokenColumns(vocab)
+    text_fields = [field for field, use in zip(_text_fields,
+                                               [True, use_lemma, use_pos,
+                                                use_ner])
+                   if use]
+    dep_kinds = dict((dtype, kind) for dtype, kind in _dep_kinds.items()
+                     if {'basic': use_basic_deps, 'coll': use_coll_deps,
+                         'coll_ccp': use_coll_ccp_deps}[kind])
+    # Values that the reference engine carries over from one element to
+    # the next when a field is missing
+    state = {'governor': None, 'dependent': None, 'mention': [None] * 4}
+
+    if use_lxml:
+        events = _lxml.iterparse(source, events=('end',),
+                                 tag=('sentence', 'sentences', 'coreference'))
+    else:
+        events = ET.iterparse(source)
+
+    sent_idx = 0
+    in_coref = False
+    for _, elem in events:
+        tag = elem.tag
+        if tag == 'sentence':
+            if in_coref:
+                continue
+            yield 'sentence', _sentence(elem, columns, sent_idx, text_fields,
+                                        use_parse, dep_kinds, state,
+                                        use_lxml)
+            _release(elem, use_lxml)
+            if fresh_columns:
+                columns = TokenColumns(vocab)
+            sent_idx += 1
+        elif tag == 'coreference':
+            if use_coref:
+                mentions = _mentions(elem, state)
+                if mentions:
+                    yield 'coref', mentions
+            _release(elem, use_lxml)
+        elif tag == 'sentences':
+            in_coref = True
+            _release(elem, use_lxml)
+            if not use_coref:
+                return
+
+
+def _release(elem, use_lxml):
+    """
+    Free a finished element. lxml elements are also detached together with
+    their finished preceding siblings; cElementTree ones, which do not know
+    their parent, stay in the tree as empty shells until it is cleared.
+    """
+    elem.clear()
+    if use_lxml:
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+def _sentence(elem, columns, sent_idx, text_fields, use_parse, dep_kinds,
+              state, use_lxml):
+    start = len(columns)
+    parse = None
+    deps = {'basic': None, 'coll': None, 'coll_ccp': None}
+    for child in elem:
+        tag = child.tag
+        if tag == 'tokens':
+            _tokens(child, columns, text_fields, use_lxml)
+        elif tag == 'parse':
+            if use_parse:
+                parse = unicode(child.text)
+        elif tag == 'dependencies':
+            kind = dep_kinds.get(child.attrib['type'])
+            if kind is not None:
+                deps[kind] = _dependencies(child, state)
+
+    sentiment = elem.attrib.get('sentiment')
+    sentiment_value = elem.attrib.get('sentimentValue')
+    if sentiment_value is not None:
+        sentiment_value = float(sentiment_value)
+    return Sentence(columns, start, len(columns), parse,
+                    _as_tuple(deps['basic']), _as_tuple(deps['coll']),
+                    _as_tuple(deps['coll_ccp']), sent_idx, sentiment,
+                    sentiment_value)
+
+
+def _tokens(tokens, columns, text_fields, use_lxml):
+    """
+    Append the tokens of a <tokens> element to columns
+    """
+    n = len(tokens)
+    if n == 0:
+        return
+    if use_lxml:
+        field_values = _lxml_fields(tokens, n, text_fields)
+    else:
+        field_values = _etree_fields(tokens, n)
+    if field_values is None:
+        field_values = _named_fields(tokens)
+
+    begins = _offsets(field_values.get('CharacterOffsetBegin'), n)
+    ends = _offsets(field_values.get('CharacterOffsetEnd'), n)
+
+    words = field_values.get('word')
+    if words is not None:
+        if not _bracket_words.isdisjoint(words):
+            words = [_brackets.get(word, word) for word in words]
+        if _quotes[0] in words or _quotes[1] in words:
+            for i, word in enumerate(words):
+                if (word in _quotes and begins[i] != -1 and ends[i] != -1 and
+                        ends[i] - begins[i] == 1):
+                    words[i] = u'"'
+        field_values['word'] = words
+
+    texts = [field_values.get(field) for field in text_fields]
+    present = [values for values in texts if values is not None]
+    get = columns.vocab.ids.get
+    ids = [map(get, values) for values in present]
+    if any(None in column_ids or 0 in column_ids for column_ids in ids):
+        # New strings (or empty elements): intern them token by token, in
+        # the same order as the reference engine, so that both assign the
+        # same Vocabulary ids.
+        k = len(present)
+        flat = _intern(columns.vocab, [text for row in zip(*present)
+                                       for text in row])
+        ids = [flat[i::k] for i in range(k)]
+    ids = iter(ids)
+    for field, values in zip(text_fields, texts):
+        if values is not None:
+            getattr(columns, _column_names[field]).extend(next(ids))
+    for field in _text_fields:
+        if field not in text_fields or field_values.get(field) is None:
+            getattr(columns, _column_names[field]).extend([0] * n)
+    columns.begin.extend(begins)
+    columns.end.extend(ends)
+
+
+def _etree_fields(tokens, n):
+    """
+    The texts of the token fields by field name, or None unless all tokens
+    have the same fields in the same order
+    """
+    layout = [e.tag for e in tokens[0]]
+    children = [e for token in tokens for e in token]
+    if [e.tag for e in children] != layout * n:
+        return None
+    texts = [e.text for e in children]
+    k = len(layout)
+    return dict((field, texts[i::k]) for i, field in enumerate(layout))
+
+
+def _lxml_fields(tokens, n, text_fields):
+    """
+    The texts of the token fields by field name, without creating Python
+    objects for the elements, or None unless every token has exactly one
+    non-empty element for each field that appears in the sentence
+    """
+    field_values = {}
+    for field in text_fields + _offset_fields:
+        values = _xpaths[field](tokens)
+        if len(values) == n:
+            field_values[field] = values
+        elif values or tokens[0].find(field) is not None:
+            return None
+    return field_values
+
+
+def _named_fields(tokens):
+    """
+    The texts of the token fields by field name, _missing for the fields a
+    token does not have. Slow path for tokens with irregular fields.
+    """
+    field_values = {}
+    for field in _text_fields + _offset_fields:
+        values = []
+        for token in tokens:
+            child = token.find(field)
+            values.append(_missing if child is None else child.text)
+        if any(value is not _missing for value in values):
+            field_values[field] = values
+    return field_values
+
+
+def _offsets(values, n):
+    if values is None:
+        return [-1] * n
+    if _missing in values:
+        return [-1 if value is _missing else int(value) for value in values]
+    return map(int, values)
+
+
+def _intern(vocab, texts):
+    """
+    Vocabulary ids of texts. A missing field gets id 0 (None) and an empty
+    element the string u'None', like unicode(elem.text) in the reference
+    engine.
+    """
+    get = vocab.ids.get
+    new = vocab.id
+    return [0 if text is _missing else (get(text) or new(unicode(text)))
+            for text in texts]
+
+
+def _dependencies(elem, state):
+    deps = []
+    for dep in elem:
+        for child in dep:
+            if child.tag == 'governor':
+                state['governor'] = max(int(child.attrib['idx']) - 1, -1)
+            elif child.tag == 'dependent':
+                idx = int(child.attrib['idx']) - 1
+                if idx > -1:
+                    state['dependent'] = idx
+        deps.append((state['dependent'], state['governor'],
+                     unicode(dep.attrib['type'])))
+    return deps
+
+
+def _mentions(elem, state):
+    """
+    Mentions of a <coreference> chain element. Fields missing from a
+    mention keep the value of the previous mention, as in the reference
+    engine.
+    """
+    values = state['mention']
+    mentions = []
+    for mention in elem:
+        if mention.tag != 'mention':
+            continue
+        for child in mention:
+            i = _mention_fields.get(child.tag)
+            if i is not None:
+                values[i] = int(child.text) - 1
+        mentions.append(Mention(values[1], values[2], values[3], values[0]))
+    return mentions
@@ -0,0 +1,188 @@
+"""
+Many small documents stored in one file.
+
+A pack is a data file holding the documents back to back and an index
+next to it (texts.pack -> texts.pack.idx) with one tab-separated line of
+name, offset and length per document:
+
+    with PackWriter('texts.pack') as pack:
+        pack.add('2008_1_001.txt', text)
+
+    pack = PackReader('texts.pack')
+    text = pack.read('2008_1_001.txt')
+
+Writing a pack costs a few large writes instead of an open, write and
+close per document, and reading one maps the data file into memory once.
+Index lines are appended as documents are added, so a writer opened with
+append=True can continue a pack whose writer was interrupted; data that
+no complete index line points to is dropped. When a name is added more
+than once, the last document added under it is the one read.
+"""
+import cStringIO
+import mmap
+import os
+
+_index_extension = '.idx'
+
+
+def index_path(path):
+    return path + _index_extension
+
+
+def is_current(path, source):
+    """
+    True if the pack at path exists and was last written after the file
+    source (e.g. the pack of texts it was annotated from) was modified
+    """
+    try:
+        return (os.path.getmtime(index_path(path)) >=
+                os.path.getmtime(source))
+    except OSError:
+        return False
+
+
+class PackWriter(object):
+
+    def __init__(self, path, append=False):
+        """
+        Create the pack at path, or continue it if append is True and it
+        exists.
+        """
+        self.path = path
+        self._index = {}
+        if append and os.path.exists(path):
+            entries = _read_index(path, os.path.getsize(path))
+            self._offset = max([offset + length
+                                for _, offset, length in entries] or [0])
+            self._data = open(path, 'r+b')
+            self._data.truncate(self._offset)
+            self._data.seek(self._offset)
+            # Rewrite the index without the lines of dropped documents
+            tmp_path = '%s.%d.tmp' % (index_path(path), os.getpid())
+            with open(tmp_path, 'w') as handle:
+                handle.writelines(_index_line(*entry) for entry in entries)
+            os.rename(tmp_path, index_path(path))
+            self._index.update((name, (offset, length))
+                               for name, offset, length in entries)
+        else:
+            self._offset = 0
+            self._data = open(path, 'wb')
+            open(index_path(path), 'w').close()
+        self._index_handle = open(index_path(path), 'a')
+
+    def add(self, name, data):
+        """
+        Add a document (a byte string, or unicode to be stored as UTF-8)
+        """
+        if '\t' in name or '\n' in name:
+            raise ValueError('pack names cannot contain tabs or newlines: %r'
+                             % name)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._data.write(data)
+        self._index_handle.write(_index_line(name, self._offset, len(data)))
+        self._index[name] = (self._offset, len(data))
+        self._offset += len(data)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        # The data goes first, so that the index never points past it
+        self._data.close()
+        self._index_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PackReader(object):
+
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        self._index = {}
+        self._names = []
+        for name, offset, length in _read_index(path, size):
+            if name not in self._index:
+                self._names.append(name)
+            self._index[name] = (offset, length)
+        self._mmap = None
+        if size:
+            with open(path, 'rb') as handle:
+                self._mmap = mmap.mmap(handle.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+
+    def read(self, name):
+        offset, length = self._index[name]
+        if length == 0:
+            return ''
+        return self._mmap[offset:offset + length]
+
+    def open(self, name):
+        """
+        The document as a file object, e.g. for corenlp.Document
+        """
+        return cStringIO.StringIO(self.read(name))
+
+    def entry(self, name):
+        """
+        The offset and length of the document in the data file; of two
+        documents, the one with the larger offset was added last
+        """
+        return self._index[name]
+
+    def size(self, name):
+        return self._index[name][1]
+
+    def names(self):
+        """
+        The names of the documents, in the order they were first added
+        """
+        return list(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def _index_line(name, offset, length):
+    return '%s\t%d\t%d\n' % (name, offset, length)
+
+
+def _read_index(path, data_size):
+    """
+    The (name, offset, length) entries of the index of the pack at path
+    whose line is complete and whose document lies within data_size bytes
+    """
+    entries = []
+    try:
+        handle = open(index_path(path))
+    except IOError:
+        return entries
+    with handle:
+        for line in handle:
+            if not line.endswith('\n'):
+                break
+            name, offset, length = line[:-1].split('\t')
+            offset, length = int(offset), int(length)
+            if offset + length > data_size:
+                break
+            entries.append((name, offset, length))
+    return entries
@@ -1,6 +1,12 @@
+import math
 import os
+import shutil
+import sys
 import tempfile
 import subprocess
+import time
+
+import pack
 
 _default_annotators = ['tokenize', 'ssplit', 'pos', 'lemma', 'ner', 'parse', 'dcoref']
 _default_mem = '2500m'
@@ -52,16 +58,181 @@ def files2dir(files, out_dir=None, annotators=None,
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
     
-    cmd = 'java -Xmx{} -cp {} {} '\
-          '-annotators {} -filelist {} '\
-          '-outputDirectory {} -threads {} '\
-          '-replaceExtension'.format(mem, cpath, 
-                                     _pipeline_class,
-                                     ','.join(annotators),
-                                     filelist.name, out_dir,
-                                     threads)
-    subprocess.check_output(cmd, shell=True)
+    cmd = _build_command(filelist.name, out_dir, annotators, mem, cpath,
+                         threads, replace_extension=True)
+    subprocess.check_output(cmd)
     filelist.close()
+
+
+def files2dir_sharded(files, out_dir=None, annotators=None, processes=1,
+                      mem_budget=None, libdir=None, libver=None, threads=None,
+                      shard_size=None, retries=2, replace_extension=True,
+                      poll_interval=1.0, callback=None):
+    """
+    Annotate files with up to `processes` CoreNLP JVMs running at once.
+
+    Inputs whose output already exists and is newer than the input are
+    skipped, so an interrupted run can simply be started again. The rest
+    are split into shards of shard_size files; each shard is annotated by
+    its own JVM, and the files of a failed shard that still have no
+    output are retried up to `retries` more times. mem_budget (e.g. '8g')
+    is divided evenly between the concurrent JVMs. callback, if given, is
+    called with (shard, returncode, seconds) each time a JVM exits.
+
+    Returns the list of files that could not be annotated.
+    """
+    if out_dir is None:
+        out_dir = '.'
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    if annotators is None:
+        annotators = _default_annotators
+
+    if mem_budget is None:
+        mem = _default_mem
+    else:
+        mem = '{}m'.format(_parse_mem(mem_budget) // processes)
+
+    if libdir is None:
+        libdir = os.getenv('CORENLP_HOME', '.')
+
+    if libver is None:
+        libver = os.getenv('CORENLP_VER', _default_libver)
+
+    if threads is None:
+        threads = _default_threads
+
+    pending = [f for f in files
+               if not _up_to_date(f, out_dir, replace_extension)]
+    if not pending:
+        return []
+
+    if shard_size is None:
+        shard_size = int(math.ceil(len(pending) / (4.0 * processes)))
+    shards = [(pending[i:i+shard_size], 0)
+              for i in range(0, len(pending), shard_size)]
+
+    cpath = _build_classpath(libdir, libver)
+    running = []
+    failed = []
+    while shards or running:
+        while shards and len(running) < processes:
+            shard, attempt = shards.pop(0)
+            filelist = _build_filelist(shard)
+            cmd = _build_command(filelist.name, out_dir, annotators, mem,
+                                 cpath, threads, replace_extension)
+            proc = subprocess.Popen(cmd)
+            running.append((proc, filelist, shard, attempt, time.time()))
+
+        time.sleep(poll_interval)
+        still_running = []
+        for proc, filelist, shard, attempt, started in running:
+            if proc.poll() is None:
+                still_running.append((proc, filelist, shard, attempt,
+                                      started))
+                continue
+            filelist.close()
+            if callback is not None:
+                callback(shard, proc.returncode, time.time() - started)
+            if proc.returncode == 0:
+                continue
+            missing = [f for f in shard
+                       if not _up_to_date(f, out_dir, replace_extension)]
+            if not missing:
+                continue
+            if attempt < retries:
+                sys.stderr.write('CoreNLP exited with status {} on a shard of '
+                                 '{} files, retrying {} of them\n'.format(
+                                     proc.returncode, len(shard),
+                                     len(missing)))
+                shards.append((missing, attempt + 1))
+            else:
+                failed.extend(missing)
+        running = still_running
+
+    return failed
+
+
+def pack2pack(text_pack, out_pack, tmp_dir=None, callback=None, **kwargs):
+    """
+    Annotate the texts of a pack (see corenlp.pack) with files2dir_sharded,
+    which takes the other arguments, and add their XML to out_pack as
+    <name>.xml. CoreNLP only reads and writes files, so the texts are
+    unpacked into a temporary directory in tmp_dir (by default the system
+    one, ideally on a local disk), and the output of each shard is packed
+    as soon as its JVM exits. If out_pack was written after text_pack, the
+    texts it already has are skipped, so an interrupted run can be
+    started again.
+
+    Returns the names of the texts that could not be annotated.
+    """
+    texts = pack.PackReader(text_pack)
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        with pack.PackWriter(out_pack,
+                             append=pack.is_current(out_pack,
+                                                    text_pack)) as out:
+            files = []
+            for name in texts:
+                if name + '.xml' not in out:
+                    files.append(os.path.join(work_dir, name))
+                    with open(files[-1], 'wb') as handle:
+                        handle.write(texts.read(name))
+
+            def shard_done(shard, returncode, seconds):
+                for fpath in shard:
+                    xml_path = _output_path(fpath, work_dir, False)
+                    xml_name = os.path.basename(xml_path)
+                    if xml_name not in out and os.path.exists(xml_path):
+                        with open(xml_path, 'rb') as handle:
+                            out.add(xml_name, handle.read())
+                if callback is not None:
+                    callback(shard, returncode, seconds)
+
+            failed = files2dir_sharded(files, work_dir,
+                                       replace_extension=False,
+                                       callback=shard_done, **kwargs)
+    finally:
+        texts.close()
+        shutil.rmtree(work_dir)
+    return [os.path.basename(fpath) for fpath in failed]
+
+
+def _output_path(fpath, out_dir, replace_extension):
+    name = os.path.basename(fpath)
+    if replace_extension:
+        name = os.path.splitext(name)[0]
+    return os.path.join(out_dir, name + '.xml')
+
+
+def _up_to_date(fpath, out_dir, replace_extension):
+    out_path = _output_path(fpath, out_dir, replace_extension)
+    return (os.path.exists(out_path) and
+            os.path.getmtime(out_path) >= os.path.getmtime(fpath))
+
+
+def _parse_mem(mem):
+    """
+    Convert a JVM memory size such as '2500m' or '8g' to megabytes.
+    """
+    units = {'k': 1.0 / 1024, 'm': 1, 'g': 1024, 't': 1024 * 1024}
+    mem = mem.strip().lower()
+    if mem[-1] in units:
+        return int(float(mem[:-1]) * units[mem[-1]])
+    return int(mem) // (1024 * 1024)
+
+
+def _build_command(filelist_name, out_dir, annotators, mem, cpath, threads,
+                   replace_extension):
+    cmd = ['java', '-Xmx{}'.format(mem), '-cp', cpath, _pipeline_class,
+           '-annotators', ','.join(annotators),
+           '-filelist', filelist_name,
+           '-outputDirectory', out_dir,
+           '-threads', str(threads)]
+    if replace_extension:
+        cmd.append('-replaceExtension')
+    return cmd
  
 
 def _build_classpath(libdir, libver):
@@ -0,0 +1,289 @@
+"""
+Client for a long-lived CoreNLP annotation server.
+
+Instead of starting a JVM and loading the models for every batch (see
+pipeline.files2dir), documents are POSTed to a StanfordCoreNLPServer that
+keeps the models in memory, and the XML it returns is written where the
+command line pipeline would have written it. Anything that speaks the
+same protocol (POST the text, get XML back) can stand in for the server.
+"""
+import httplib
+import itertools
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty, Full
+
+import pack
+import pipeline
+
+_default_url = 'http://localhost:9000'
+_default_pool_size = 4
+_default_retries = 3
+_default_timeout = 600
+_poll_interval = 0.1
+_server_class = 'edu.stanford.nlp.pipeline.StanfordCoreNLPServer'
+
+
+class ServerError(Exception):
+    pass
+
+
+class _RetryableError(Exception):
+    pass
+
+
+class Client(object):
+    """
+    Annotates texts through a CoreNLP server. Connections are kept alive
+    and reused; up to pool_size requests are in flight at once in
+    annotate_many. Requests that fail because of a connection error or a
+    5xx response are retried up to retries times with exponential
+    backoff.
+    """
+
+    def __init__(self, url=None, annotators=None, pool_size=None,
+                 retries=None, timeout=None, backoff=1.0):
+        if url is None:
+            url = os.getenv('CORENLP_URL', _default_url)
+        if annotators is None:
+            annotators = pipeline._default_annotators
+        if pool_size is None:
+            pool_size = _default_pool_size
+        if retries is None:
+            retries = _default_retries
+        if timeout is None:
+            timeout = _default_timeout
+
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        properties = {'annotators': ','.join(annotators),
+                      'outputFormat': 'xml'}
+        self.path = '%s?%s' % (parsed.path or '/',
+                               urllib.urlencode(
+                                   {'properties': json.dumps(properties)}))
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self._connections = Queue()
+
+    def annotate(self, text):
+        """
+        Return the CoreNLP XML for text (a unicode or UTF-8 encoded
+        string) as a byte string.
+        """
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        attempt = 0
+        while True:
+            try:
+                return self._post(text)
+            except (socket.error, httplib.HTTPException,
+                    _RetryableError), exc:
+                attempt += 1
+                if attempt > self.retries:
+                    raise ServerError('CoreNLP server at %s:%s failed after '
+                                      '%d attempts: %s' % (self.host,
+                                                           self.port,
+                                                           attempt, exc))
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def annotate_many(self, texts, raise_errors=True):
+        """
+        Annotate texts concurrently and yield their XML in input order.
+        Only twice pool_size texts are read ahead of the XML consumed, so
+        texts can be a generator over many files. With raise_errors False,
+        the ServerError of a text that could not be annotated is yielded
+        in place of its XML.
+        """
+        pool = ThreadPool(self.pool_size)
+        # pool.imap reads its input as fast as it can; a slot is taken for
+        # each text read and given back for each result yielded
+        slots = Queue(2 * self.pool_size)
+        stopping = threading.Event()
+
+        def feed():
+            for text in texts:
+                while True:
+                    try:
+                        slots.put(None, timeout=_poll_interval)
+                        break
+                    except Full:
+                        if stopping.is_set():
+                            return
+                yield text
+
+        annotate = self.annotate if raise_errors else self._annotate_or_error
+        try:
+            for xml in pool.imap(annotate, feed()):
+                slots.get()
+                yield xml
+        finally:
+            stopping.set()
+            pool.terminate()
+
+    def _annotate_or_error(self, text):
+        try:
+            return self.annotate(text)
+        except ServerError, exc:
+            return exc
+
+    def close(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except Empty:
+                break
+
+    def _post(self, body):
+        try:
+            conn = self._connections.get_nowait()
+        except Empty:
+            conn = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+        try:
+            conn.request('POST', self.path, body,
+                         {'Content-Type': 'text/plain; charset=utf-8'})
+            response = conn.getresponse()
+            content = response.read()
+        except:
+            conn.close()
+            raise
+
+        if response.status >= 500:
+            conn.close()
+            raise _RetryableError('HTTP %d' % response.status)
+        self._connections.put(conn)
+        if response.status != 200:
+            raise ServerError('CoreNLP server returned HTTP %d: %s' %
+                              (response.status, content[:200]))
+        return content
+
+
+def files2dir(files, out_dir=None, url=None, annotators=None,
+              pool_size=None, retries=None, client=None, callback=None):
+    """
+    Annotate text files through a server and write <name>.xml for every
+    input file <name> in out_dir, like the command line pipeline without
+    -replaceExtension. Inputs whose output already exists and is newer
+    than the input are skipped, as in pipeline.files2dir_sharded.
+    callback, if given, is called with the path of each file annotated.
+
+    Returns the files that could not be annotated.
+    """
+    if out_dir is None:
+        out_dir = '.'
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    own_client = client is None
+    if own_client:
+        client = Client(url, annotators=annotators, pool_size=pool_size,
+                        retries=retries)
+
+    def read(fpath):
+        with open(fpath) as handle:
+            return handle.read()
+
+    # A list, since it is read both for the texts and for the output names
+    files = [fpath for fpath in files
+             if not pipeline._up_to_date(fpath, out_dir, False)]
+    failed = []
+    xmls = client.annotate_many((read(fpath) for fpath in files),
+                                raise_errors=False)
+    try:
+        for fpath, xml in itertools.izip(files, xmls):
+            if isinstance(xml, ServerError):
+                failed.append(fpath)
+                continue
+            with open(pipeline._output_path(fpath, out_dir, False),
+                      'wb') as handle:
+                handle.write(xml)
+            if callback is not None:
+                callback(fpath)
+    finally:
+        # Stop the requests in flight before closing their connections
+        xmls.close()
+        if own_client:
+            client.close()
+    return failed
+
+
+def pack2pack(text_pack, out_pack, url=None, annotators=None,
+              pool_size=None, retries=None, client=None, callback=None):
+    """
+    Annotate the texts of a pack (see corenlp.pack) through a server and
+    add their XML to out_pack as <name>.xml, skipping those it already
+    has if it was written after text_pack, as pipeline.pack2pack does.
+    callback, if given, is called with the name of each text annotated.
+
+    Returns the names of the texts that could not be annotated.
+    """
+    own_client = client is None
+    if own_client:
+        client = Client(url, annotators=annotators, pool_size=pool_size,
+                        retries=retries)
+    texts = pack.PackReader(text_pack)
+    xmls = None
+    failed = []
+    try:
+        with pack.PackWriter(out_pack,
+                             append=pack.is_current(out_pack,
+                                                    text_pack)) as out:
+            names = [name for name in texts if name + '.xml' not in out]
+            xmls = client.annotate_many((texts.read(name) for name in names),
+                                        raise_errors=False)
+            for name, xml in itertools.izip(names, xmls):
+                if isinstance(xml, ServerError):
+                    failed.append(name)
+                    continue
+                out.add(name + '.xml', xml)
+                if callback is not None:
+                    callback(name)
+    finally:
+        # The pool must stop reading texts before they are unmapped
+        if xmls is not None:
+            xmls.close()
+        texts.close()
+        if own_client:
+            client.close()
+    return failed
+
+
+def start_server(libdir=None, port=9000, mem=None, threads=None,
+                 wait=120):
+    """
+    Start a StanfordCoreNLPServer in the background and return the Popen
+    object once it accepts connections. The caller is responsible for
+    terminating it.
+    """
+    if libdir is None:
+        libdir = os.getenv('CORENLP_HOME', '.')
+    if mem is None:
+        mem = pipeline._default_mem
+    if threads is None:
+        threads = pipeline._default_threads
+
+    cmd = ['java', '-Xmx%s' % mem, '-cp', os.path.join(libdir, '*'),
+           _server_class, '-port', str(port), '-threads', str(threads)]
+    proc = subprocess.Popen(cmd)
+
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise ServerError('CoreNLP server exited with status %d' %
+                              proc.returncode)
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return proc
+        except socket.error:
+            time.sleep(0.5)
+    proc.terminate()
+    raise ServerError('CoreNLP server did not start within %d seconds' % wait)
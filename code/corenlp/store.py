@@ -0,0 +1,224 @@
+"""
+Corpus-wide, memory-mapped store of CoreNLP annotations.
+
+The store is built once from many CoreNLP XML files. Token, sentence and
+mention attributes of all documents are concatenated into flat int32
+files, which are opened with numpy.memmap, so that any number of
+processes can share them through the page cache without copying or
+parsing XML. A document table maps each document's key to its rows in
+these arrays.
+
+    build(((key, xmlfile) for ...), 'corpus_store')
+    store = Store('corpus_store')
+    doc = store.document(key)            # a corenlp.Document
+    lo, hi = store.token_range(key)
+    store.lemma[lo:hi]                   # Vocabulary ids, no copy
+"""
+import cPickle
+import math
+import os
+from array import array
+
+import numpy
+
+from corenlp import (Document, Mention, Sentence, TokenColumns, Vocabulary,
+                     _parse_source)
+
+_version = 1
+_token_columns = ['surface', 'lemma', 'pos', 'ner', 'begin', 'end']
+_sentence_columns = ['sent_start', 'sent_end', 'sent_sentiment',
+                     'sent_sentiment_value']
+_mention_columns = ['mention_chain', 'mention_sent', 'mention_start',
+                    'mention_end', 'mention_head']
+# Rows of the document table
+_doc_columns = ['sent_lo', 'sent_hi', 'mention_lo', 'mention_hi',
+                'token_lo', 'token_hi', 'chain_lo', 'chain_hi']
+
+
+def build(items, store_dir, pos=True, lemma=True, ner=True, verbose=False):
+    """
+    Build a store in store_dir from items, an iterable of (key, xmlfile)
+    pairs where key is any picklable, hashable value. Documents are
+    written to disk one at a time, so memory use does not grow with the
+    size of the corpus.
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    vocab = Vocabulary()
+    names = _token_columns + _sentence_columns + _mention_columns
+    handles = dict((name, open(_column_path(store_dir, name), 'wb'))
+                   for name in names)
+    keys = []
+    table = array('i')
+    n_tokens = n_sents = n_mentions = n_chains = 0
+    try:
+        for key, xmlfile in items:
+            columns = TokenColumns(vocab)
+            sents, chains = _parse_source(xmlfile, columns, use_pos=pos,
+                                          use_lemma=lemma, use_ner=ner,
+                                          use_parse=False, use_coref=True,
+                                          use_coll_ccp_deps=False,
+                                          verbose=verbose)
+            for name in _token_columns:
+                getattr(columns, name).tofile(handles[name])
+
+            sent_columns = dict((name, array('i'))
+                                for name in _sentence_columns[:-1])
+            sentiment_values = array('d')
+            for sent in sents:
+                sent_columns['sent_start'].append(n_tokens + sent._start)
+                sent_columns['sent_end'].append(n_tokens + sent._end)
+                sent_columns['sent_sentiment'].append(vocab.id(sent.sentiment))
+                sentiment_values.append(float('nan')
+                                        if sent.sentiment_value is None
+                                        else sent.sentiment_value)
+            for name, column in sent_columns.items():
+                column.tofile(handles[name])
+            sentiment_values.tofile(handles['sent_sentiment_value'])
+
+            mention_columns = dict((name, array('i'))
+                                   for name in _mention_columns)
+            for chain_id, chain in enumerate(chains):
+                for m in chain:
+                    mention_columns['mention_chain'].append(chain_id)
+                    mention_columns['mention_sent'].append(m.sent)
+                    mention_columns['mention_start'].append(m.start)
+                    mention_columns['mention_end'].append(m.end)
+                    mention_columns['mention_head'].append(m.head)
+            for name, column in mention_columns.items():
+                column.tofile(handles[name])
+
+            doc_mentions = len(mention_columns['mention_chain'])
+            table.extend([n_sents, n_sents + len(sents),
+                          n_mentions, n_mentions + doc_mentions,
+                          n_tokens, n_tokens + len(columns),
+                          n_chains, n_chains + len(chains)])
+            keys.append(key)
+            n_tokens += len(columns)
+            n_sents += len(sents)
+            n_mentions += doc_mentions
+            n_chains += len(chains)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    with open(_column_path(store_dir, 'documents'), 'wb') as handle:
+        table.tofile(handle)
+    meta = {'version': _version,
+            'keys': keys,
+            'vocab': vocab.strings,
+            'counts': {'tokens': n_tokens, 'sents': n_sents,
+                       'mentions': n_mentions, 'docs': len(keys)}}
+    with open(os.path.join(store_dir, 'meta.pickle'), 'wb') as handle:
+        cPickle.dump(meta, handle, cPickle.HIGHEST_PROTOCOL)
+
+
+class Store(object):
+    """
+    Read-only view of a store built by build(). Column arrays are
+    attributes named after the columns (store.lemma, store.sent_start,
+    store.mention_head, ...). Pickling a Store only pickles its path, so
+    worker processes reopen the same memory-mapped files.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.pickle'), 'rb') as handle:
+            meta = cPickle.load(handle)
+        if meta.get('version') != _version:
+            raise ValueError('%s was built by an incompatible version' %
+                             store_dir)
+        self.vocab = Vocabulary()
+        self.vocab.strings = meta['vocab']
+        self.vocab.ids = dict((s, i) for i, s in enumerate(meta['vocab']))
+        self.keys = meta['keys']
+        self._rows = dict((key, i) for i, key in enumerate(self.keys))
+
+        counts = meta['counts']
+        for name in _token_columns:
+            setattr(self, name, self._map(name, numpy.int32,
+                                          counts['tokens']))
+        for name in _sentence_columns[:-1]:
+            setattr(self, name, self._map(name, numpy.int32,
+                                          counts['sents']))
+        self.sent_sentiment_value = self._map('sent_sentiment_value',
+                                              numpy.float64, counts['sents'])
+        for name in _mention_columns:
+            setattr(self, name, self._map(name, numpy.int32,
+                                          counts['mentions']))
+        self.documents = self._map('documents', numpy.int32,
+                                   counts['docs'] * len(_doc_columns))
+        self.documents = self.documents.reshape((counts['docs'],
+                                                 len(_doc_columns)))
+
+        # All documents share one set of token columns over the mapped
+        # arrays; sentences index into them with corpus-wide rows.
+        self.columns = TokenColumns(self.vocab)
+        for name in _token_columns:
+            setattr(self.columns, name, getattr(self, name))
+
+    def _map(self, name, dtype, length):
+        if length == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(_column_path(self.store_dir, name), dtype=dtype,
+                            mode='r', shape=(length,))
+
+    def __getstate__(self):
+        return {'store_dir': self.store_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_dir'])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _row(self, key):
+        return self.documents[self._rows[key]]
+
+    def token_range(self, key):
+        row = self._row(key)
+        return int(row[4]), int(row[5])
+
+    def sentence_range(self, key):
+        row = self._row(key)
+        return int(row[0]), int(row[1])
+
+    def mention_range(self, key):
+        row = self._row(key)
+        return int(row[2]), int(row[3])
+
+    def document(self, key):
+        """
+        Return the corenlp.Document stored under key. Its tokens are views
+        of the mapped arrays; parse trees and dependencies are not stored.
+        """
+        sent_lo, sent_hi, mention_lo, mention_hi = self._row(key)[:4]
+        strings = self.vocab.strings
+        sents = []
+        for i in xrange(sent_lo, sent_hi):
+            value = float(self.sent_sentiment_value[i])
+            sents.append(Sentence(self.columns, int(self.sent_start[i]),
+                                  int(self.sent_end[i]), None, None, None,
+                                  None, i - sent_lo,
+                                  strings[self.sent_sentiment[i]],
+                                  None if math.isnan(value) else value))
+
+        chains = []
+        prev_chain = None
+        for i in xrange(mention_lo, mention_hi):
+            if self.mention_chain[i] != prev_chain:
+                chains.append([])
+                prev_chain = self.mention_chain[i]
+            chains[-1].append(Mention(int(self.mention_start[i]),
+                                      int(self.mention_end[i]),
+                                      int(self.mention_head[i]),
+                                      int(self.mention_sent[i])))
+        return Document._from_parts(self.columns, sents, chains)
+
+
+def _column_path(store_dir, name):
+    return os.path.join(store_dir, name + '.bin')
@@ -0,0 +1,228 @@
+'''
+Persistent inverted index over an annotation store (see
+annot.build_annotation_store) for corpus-wide sentence queries.
+
+    build_index(corenlp.store.Store(store_dir), index_dir)
+    index = CorpusIndex(index_dir)
+    index.sentences(Lemma('tax') & Party('rep'), year=2008)
+    index.sentences(Lemma('tax') | NER('MONEY'), year=[2008, 2012], debate=1)
+
+Postings are kept as sorted numpy arrays: lemma (case-insensitive) and
+NER type map to token ids, candidate parties to sentence ids. Queries
+combine sentence id arrays with numpy set operations.
+'''
+import cPickle
+import os
+
+import numpy
+
+import data
+from annot import DocAnnotation
+from corenlp.store import Store
+
+_version = 1
+
+
+def build_index(store, index_dir):
+    '''
+    Build an index of store (a corenlp.store.Store keyed by (year, debate,
+    doc_id)) in index_dir.
+    '''
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+    n_sents = len(store.sent_start)
+    sent_lengths = numpy.asarray(store.sent_end) - store.sent_start
+    token_sent = numpy.repeat(numpy.arange(n_sents, dtype=numpy.int32),
+                              sent_lengths)
+    doc_sents = store.documents[:, 1] - store.documents[:, 0]
+    sent_doc = numpy.repeat(numpy.arange(len(store), dtype=numpy.int32),
+                            doc_sents)
+
+    lemma_terms, lemma_order, lemma_offsets = _postings(
+        store.lemma, store.vocab, lambda s: s.lower())
+    ner_terms, ner_order, ner_offsets = _postings(
+        store.ner, store.vocab, lambda s: s)
+
+    party_sents = dict((party, []) for party in data.parties)
+    for key in store.keys:
+        year, debate, doc_id = key
+        annot = DocAnnotation(None, year, debate, doc_id, store=store)
+        sent_lo = store.sentence_range(key)[0]
+        for party in data.candidates[year]:
+            rows = numpy.flatnonzero(annot.party_mentions([party])[:, 0])
+            party_sents[party].append(rows + sent_lo)
+
+    arrays = {'token_sent': token_sent,
+              'sent_doc': sent_doc,
+              'doc_year': numpy.array([k[0] for k in store.keys]),
+              'doc_debate': numpy.array([k[1] for k in store.keys]),
+              'lemma_order': lemma_order,
+              'lemma_offsets': lemma_offsets,
+              'ner_order': ner_order,
+              'ner_offsets': ner_offsets}
+    for party, rows in party_sents.items():
+        arrays['party_' + party] = (numpy.concatenate(rows).astype(numpy.int32)
+                                    if rows else
+                                    numpy.zeros(0, dtype=numpy.int32))
+    for name, values in arrays.items():
+        numpy.save(os.path.join(index_dir, name + '.npy'), values)
+
+    meta = {'version': _version,
+            'store_dir': os.path.abspath(store.store_dir),
+            'keys': store.keys,
+            'sent_lo': [int(x) for x in store.documents[:, 0]],
+            'lemma_terms': lemma_terms,
+            'ner_terms': ner_terms}
+    with open(os.path.join(index_dir, 'meta.pickle'), 'wb') as handle:
+        cPickle.dump(meta, handle, cPickle.HIGHEST_PROTOCOL)
+
+
+def _postings(column, vocab, normalize):
+    '''
+    Group the token ids of column by normalized term. Returns a dict from
+    term to its position in the grouping, the token ids sorted by term and
+    the offsets of each term's tokens in that order.
+    '''
+    terms = {}
+    canon = numpy.zeros(len(vocab), dtype=numpy.int32)
+    for i, s in enumerate(vocab.strings):
+        if s is None:
+            canon[i] = -1
+            continue
+        canon[i] = terms.setdefault(normalize(s), len(terms))
+    term_ids = canon[numpy.asarray(column)]
+    order = numpy.argsort(term_ids, kind='mergesort').astype(numpy.int32)
+    offsets = numpy.searchsorted(term_ids[order],
+                                 numpy.arange(len(terms) + 1))
+    return terms, order, offsets
+
+
+class Term(object):
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+
+class Lemma(Term):
+    def __init__(self, lemma):
+        self.lemma = lemma
+
+    def sentences(self, index):
+        return index._token_term_sentences('lemma', self.lemma.lower())
+
+
+class NER(Term):
+    def __init__(self, ner):
+        self.ner = ner
+
+    def sentences(self, index):
+        return index._token_term_sentences('ner', self.ner)
+
+
+class Party(Term):
+    '''
+    Sentences that mention the candidate of a party (see
+    annot.DocAnnotation.find_candidate_mentions)
+    '''
+    def __init__(self, party):
+        self.party = party
+
+    def sentences(self, index):
+        return index._arrays['party_' + self.party]
+
+
+class And(Term):
+    def __init__(self, *terms):
+        self.terms = terms
+
+    def sentences(self, index):
+        result = self.terms[0].sentences(index)
+        for term in self.terms[1:]:
+            result = numpy.intersect1d(result, term.sentences(index),
+                                       assume_unique=True)
+        return result
+
+
+class Or(Term):
+    def __init__(self, *terms):
+        self.terms = terms
+
+    def sentences(self, index):
+        return reduce(numpy.union1d,
+                      [term.sentences(index) for term in self.terms])
+
+
+class CorpusIndex(object):
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.pickle'), 'rb') as handle:
+            meta = cPickle.load(handle)
+        if meta.get('version') != _version:
+            raise ValueError('%s was built by an incompatible version' %
+                             index_dir)
+        self.index_dir = index_dir
+        self.store_dir = meta['store_dir']
+        self.keys = meta['keys']
+        self._sent_lo = numpy.array(meta['sent_lo'])
+        self._terms = {'lemma': meta['lemma_terms'],
+                       'ner': meta['ner_terms']}
+        self._arrays = {}
+        for filename in os.listdir(index_dir):
+            name, ext = os.path.splitext(filename)
+            if ext == '.npy':
+                self._arrays[name] = numpy.load(
+                    os.path.join(index_dir, filename), mmap_mode='r')
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = Store(self.store_dir)
+        return self._store
+
+    def _token_term_sentences(self, kind, term):
+        term_id = self._terms[kind].get(term)
+        if term_id is None:
+            return numpy.zeros(0, dtype=numpy.int32)
+        offsets = self._arrays[kind + '_offsets']
+        tokens = self._arrays[kind + '_order'][offsets[term_id]:
+                                               offsets[term_id + 1]]
+        return numpy.unique(self._arrays['token_sent'][tokens])
+
+    def tokens(self, lemma):
+        '''
+        Corpus-wide token ids of a lemma, usable with the store's columns
+        '''
+        term_id = self._terms['lemma'].get(lemma.lower())
+        if term_id is None:
+            return numpy.zeros(0, dtype=numpy.int32)
+        offsets = self._arrays['lemma_offsets']
+        return self._arrays['lemma_order'][offsets[term_id]:
+                                           offsets[term_id + 1]]
+
+    def sentence_ids(self, query, year=None, debate=None):
+        '''
+        Corpus-wide ids of the sentences that match query, optionally
+        restricted to some years or debate numbers (a value or a list)
+        '''
+        ids = numpy.asarray(query.sentences(self))
+        docs = self._arrays['sent_doc'][ids]
+        mask = numpy.ones(len(ids), dtype=bool)
+        for name, value in [('doc_year', year), ('doc_debate', debate)]:
+            if value is not None:
+                mask &= numpy.in1d(self._arrays[name][docs],
+                                   numpy.atleast_1d(value))
+        return ids[mask]
+
+    def sentences(self, query, year=None, debate=None):
+        '''
+        List of ((year, debate, doc_id), sentence index) pairs for the
+        sentences that match query
+        '''
+        ids = self.sentence_ids(query, year, debate)
+        docs = self._arrays['sent_doc'][ids]
+        return [(self.keys[d], int(i - self._sent_lo[d]))
+                for i, d in zip(ids, docs)]
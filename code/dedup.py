@@ -0,0 +1,143 @@
+'''
+Find syndicated articles that appear more than once in the exports, so
+that each text is annotated by CoreNLP only once.
+
+    groups = duplicate_groups(docs, near_duplicates=True)
+    for group in groups:
+        representative, copies = group[0], group[1:]
+
+Texts are duplicates when they are equal once runs of whitespace are
+collapsed. With near_duplicates, texts whose word shingles have an
+estimated Jaccard similarity of at least threshold (MinHash with
+locality-sensitive hashing) are grouped as well; their copies then share
+the annotation of the representative, so small differences between them,
+e.g. a corrected typo, do not reach the output.
+'''
+import csv
+import hashlib
+import zlib
+
+import numpy
+
+_prime = 4294967311  # smallest prime above 2 ** 32
+
+
+def normalize(text):
+    return ' '.join(text.split())
+
+
+def text_hash(text):
+    '''
+    Hash of the normalized text
+    '''
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.md5(normalize(text)).hexdigest()
+
+
+def duplicate_groups(docs, near_duplicates=False, threshold=0.9,
+                     shingle_size=5, num_perm=64, bands=16, seed=0):
+    '''
+    Group the indices of docs (dicts with a 'text') that have the same
+    text. Returns the groups of more than one document, each sorted, so
+    that the first document of a group is its representative.
+    '''
+    groups = {}
+    for i, doc in enumerate(docs):
+        groups.setdefault(text_hash(doc['text']), []).append(i)
+    exact = sorted(groups.values())
+
+    if near_duplicates:
+        representatives = [group[0] for group in exact]
+        signatures = minhash_signatures([docs[i]['text'] for i in
+                                         representatives],
+                                        shingle_size, num_perm, seed)
+        merged = {}
+        for rep_group in _similar_groups(signatures, threshold, bands):
+            target = exact[rep_group[0]]
+            for j in rep_group[1:]:
+                merged[j] = target
+                target.extend(exact[j])
+        exact = [sorted(group) for j, group in enumerate(exact)
+                 if j not in merged]
+        exact.sort()
+
+    return [group for group in exact if len(group) > 1]
+
+
+def minhash_signatures(texts, shingle_size=5, num_perm=64, seed=0):
+    '''
+    MinHash signatures (one row of num_perm values per text) of the sets
+    of shingle_size-word shingles of texts
+    '''
+    rng = numpy.random.RandomState(seed)
+    a = rng.randint(1, 1 << 31, num_perm).astype(numpy.uint64)
+    b = rng.randint(0, 1 << 31, num_perm).astype(numpy.uint64)
+    signatures = numpy.empty((len(texts), num_perm), dtype=numpy.uint64)
+    for i, text in enumerate(texts):
+        hashes = numpy.array(list(_shingle_hashes(text, shingle_size)),
+                             dtype=numpy.uint64)
+        signatures[i] = ((a[:, None] * hashes[None, :] + b[:, None]) %
+                         _prime).min(axis=1)
+    return signatures
+
+
+def _shingle_hashes(text, size):
+    words = text.lower().split()
+    if len(words) <= size:
+        yield zlib.crc32(' '.join(words)) & 0xffffffff
+        return
+    for i in xrange(len(words) - size + 1):
+        yield zlib.crc32(' '.join(words[i:i + size])) & 0xffffffff
+
+
+def _similar_groups(signatures, threshold, bands):
+    '''
+    Group the rows of signatures whose estimated similarity is at least
+    threshold, comparing only the pairs that share a band
+    '''
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = range(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        buckets = {}
+        chunk = signatures[:, band * rows:(band + 1) * rows]
+        for i in range(n):
+            buckets.setdefault(chunk[i].tostring(), []).append(i)
+        for members in buckets.values():
+            first = members[0]
+            for j in members[1:]:
+                root_first, root_j = find(first), find(j)
+                if root_first == root_j:
+                    continue
+                if numpy.mean(signatures[first] == signatures[j]) >= threshold:
+                    parent[max(root_first, root_j)] = min(root_first, root_j)
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [group for group in sorted(groups.values()) if len(group) > 1]
+
+
+def write_duplicates(filename, pairs):
+    '''
+    Write (copy, representative) file name pairs to a CSV file
+    '''
+    with open(filename, 'wb') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['copy', 'representative'])
+        writer.writerows(pairs)
+
+
+def read_duplicates(filename):
+    with open(filename, 'rb') as handle:
+        reader = csv.reader(handle)
+        next(reader)
+        return [tuple(row) for row in reader]
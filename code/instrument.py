@@ -0,0 +1,177 @@
+'''
+Timers and counters for the stages of a pipeline run.
+
+    stats = Stats(profile=['final_output'])
+    with stats.timer('load'):
+        ...
+        stats.count('documents_parsed', len(docs))
+
+    @stats.timer('dump_to_dir')
+    def dump(...):
+        ...
+
+    stats.document((2008, 1, 7), seconds=0.2, tokens=1500)
+    stats.slowest_documents(10)
+    stats.write_json('run_stats.json')
+    print stats.prometheus()
+    stats.dump_profiles('profiles')
+
+Counters belong to the innermost stage running in the calling thread
+unless a stage is given. A Stats can be shared by several threads.
+Stages listed in profile run under cProfile; their profiles accumulate
+over calls and can be written as .prof files for pstats or snakeviz.
+Only the calling process is profiled, not worker processes.
+'''
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class _Timer(object):
+    '''
+    Context manager and decorator that times a stage of stats
+    '''
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.stats._stack().append(self.stage)
+        self.profile = None
+        if self.stage in self.stats.profile:
+            self.profile = self.stats._profiles.setdefault(self.stage,
+                                                          cProfile.Profile())
+            self.profile.enable()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        self.stats._stack().pop()
+        with self.stats._lock:
+            stage = self.stats._stage(self.stage)
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+
+    def __call__(self, func):
+        def wrapper(*args, **kwargs):
+            with _Timer(self.stats, self.stage):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+
+class Stats(object):
+
+    def __init__(self, profile=()):
+        '''
+        profile: names of the stages to run under cProfile
+        '''
+        self.profile = set(profile)
+        self.stages = {}
+        self.documents = {}
+        self._profiles = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _stack(self):
+        '''
+        The stages running in the calling thread, innermost last
+        '''
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'calls': 0,
+                                 'counters': defaultdict(int)}
+        return self.stages[name]
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def count(self, name, n=1, stage=None):
+        '''
+        Add n to the counter name of stage, by default the innermost
+        running stage ('run' outside of any stage)
+        '''
+        if stage is None:
+            stack = self._stack()
+            stage = stack[-1] if stack else 'run'
+        with self._lock:
+            self._stage(stage)['counters'][name] += n
+
+    def document(self, key, seconds=0.0, stage=None, **counters):
+        '''
+        Record the time and counters (e.g. tokens) of a single document.
+        They are also added to the counters of stage, the time as
+        'document_seconds'.
+        '''
+        with self._lock:
+            record = self.documents.setdefault(key, defaultdict(int))
+            record['seconds'] += seconds
+            self.count('document_seconds', seconds, stage)
+            for name, n in counters.items():
+                record[name] += n
+                self.count(name, n, stage)
+
+    def slowest_documents(self, n=10):
+        '''
+        The n documents with the largest 'seconds' counter, as (key,
+        counters) pairs
+        '''
+        return sorted(self.documents.items(),
+                      key=lambda item: item[1].get('seconds', 0),
+                      reverse=True)[:n]
+
+    def to_dict(self):
+        return {'stages': dict((name, {'seconds': stage['seconds'],
+                                       'calls': stage['calls'],
+                                       'counters': dict(stage['counters'])})
+                               for name, stage in self.stages.items()),
+                'documents': [{'key': list(key) if isinstance(key, tuple)
+                               else key, 'counters': dict(counters)}
+                              for key, counters in
+                              sorted(self.documents.items())]}
+
+    def write_json(self, filename):
+        with open(filename, 'w') as handle:
+            json.dump(self.to_dict(), handle, indent=2, sort_keys=True)
+
+    def prometheus(self, prefix='debates'):
+        '''
+        The stage timings and counters in the Prometheus text format.
+        Per-document counters are left out.
+        '''
+        families = defaultdict(list)
+        for name, stage in self.stages.items():
+            families['stage_seconds'].append((name, stage['seconds']))
+            families['stage_calls'].append((name, stage['calls']))
+            for counter, value in stage['counters'].items():
+                families[counter].append((name, value))
+        lines = []
+        for family, samples in sorted(families.items()):
+            lines.append('# TYPE %s_%s counter' % (prefix, family))
+            for name, value in sorted(samples):
+                lines.append('%s_%s{stage="%s"} %r' %
+                             (prefix, family, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def dump_profiles(self, directory):
+        '''
+        Write the profile of each profiled stage to directory/<stage>.prof
+        '''
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for stage, profile in self._profiles.items():
+            profile.dump_stats(os.path.join(directory, stage + '.prof'))
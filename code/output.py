@@ -0,0 +1,178 @@
+'''
+Writers for the rows of ArticleParser.final_output.
+
+A row is a list of metadata values (one per field), the party bucket and
+the list of sentence strings in that bucket. Writers stream rows to the
+output file in batches of buffer_size rows and never join a document's
+sentences into one string:
+
+- CSVWriter: the historical layout, with the text split over as many
+  columns of at most max_field_size characters as needed.
+- JSONLinesWriter: one JSON object per row, with the sentences as a list.
+- ParquetWriter: a list<string> 'sentences' column; requires pyarrow.
+
+Values and sentences are byte strings. CSVWriter writes them as they are;
+the other writers decode them from encoding, replacing the bytes that are
+not valid in it, since metadata from the exports is not always valid
+UTF-8.
+'''
+import csv
+import json
+import os
+
+
+class OutputWriter(object):
+
+    def __init__(self, filename, fields, buffer_size=1000, encoding='utf-8'):
+        self.filename = filename
+        self.fields = fields
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self._buffer = []
+
+    def write(self, values, party, sentences):
+        self._buffer.append((values, party, sentences))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CSVWriter(OutputWriter):
+
+    def __init__(self, filename, fields, buffer_size=1000, encoding='utf-8',
+                 max_field_size=30000):
+        super(CSVWriter, self).__init__(filename, fields, buffer_size,
+                                        encoding)
+        self.max_field_size = max_field_size
+        self._handle = open(filename, 'wb')
+        self._writer = csv.writer(self._handle)
+        self._writer.writerow(fields + ['party', 'text'])
+
+    def _write_rows(self, rows):
+        self._writer.writerows(
+            values + [party] + list(split_text(sentences,
+                                               self.max_field_size))
+            for values, party, sentences in rows)
+
+    def close(self):
+        super(CSVWriter, self).close()
+        self._handle.close()
+
+
+class JSONLinesWriter(OutputWriter):
+
+    def __init__(self, filename, fields, buffer_size=1000, encoding='utf-8'):
+        super(JSONLinesWriter, self).__init__(filename, fields, buffer_size,
+                                              encoding)
+        self._handle = open(filename, 'wb')
+
+    def _write_rows(self, rows):
+        lines = []
+        for values, party, sentences in rows:
+            record = dict(zip(self.fields,
+                              [_text(value, self.encoding)
+                               for value in values]))
+            record['party'] = party
+            record['sentences'] = [_text(s, self.encoding)
+                                   for s in sentences]
+            lines.append(json.dumps(record))
+            lines.append('\n')
+        self._handle.write(''.join(lines))
+
+    def close(self):
+        super(JSONLinesWriter, self).close()
+        self._handle.close()
+
+
+class ParquetWriter(OutputWriter):
+
+    def __init__(self, filename, fields, buffer_size=10000,
+                 encoding='utf-8'):
+        super(ParquetWriter, self).__init__(filename, fields, buffer_size,
+                                            encoding)
+        import pyarrow
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._schema = pyarrow.schema(
+            [pyarrow.field(field, pyarrow.string()) for field in fields] +
+            [pyarrow.field('party', pyarrow.string()),
+             pyarrow.field('sentences', pyarrow.list_(pyarrow.string()))])
+        self._writer = pyarrow.parquet.ParquetWriter(filename, self._schema)
+
+    def _write_rows(self, rows):
+        columns = [[_text(values[i], self.encoding) for values, _, _ in rows]
+                   for i in range(len(self.fields))]
+        columns.append([party for _, party, _ in rows])
+        columns.append([[_text(s, self.encoding) for s in sentences]
+                        for _, _, sentences in rows])
+        arrays = [self._pa.array(column, type=field.type)
+                  for column, field in zip(columns, self._schema)]
+        self._writer.write_table(
+            self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        super(ParquetWriter, self).close()
+        self._writer.close()
+
+
+writers = {'csv': CSVWriter,
+           'jsonl': JSONLinesWriter,
+           'parquet': ParquetWriter}
+
+_extensions = {'.csv': 'csv',
+               '.jsonl': 'jsonl',
+               '.json': 'jsonl',
+               '.parquet': 'parquet'}
+
+
+def open_writer(filename, fields, format=None, **kwargs):
+    '''
+    Open a writer for filename. format is one of the keys of writers; by
+    default it is guessed from the extension, falling back to CSV.
+    '''
+    if format is None:
+        ext = os.path.splitext(filename)[1].lower()
+        format = _extensions.get(ext, 'csv')
+    return writers[format](filename, fields, **kwargs)
+
+
+def split_text(sentences, size):
+    '''
+    Yield ' '.join(sentences) in pieces of at most size characters,
+    without building the joined string.
+    '''
+    pieces = []
+    length = 0
+    for i, sentence in enumerate(sentences):
+        if i > 0:
+            sentence = ' ' + sentence
+        while sentence:
+            room = size - length
+            pieces.append(sentence[:room])
+            length += len(pieces[-1])
+            sentence = sentence[room:]
+            if length == size:
+                yield ''.join(pieces)
+                pieces = []
+                length = 0
+    if pieces:
+        yield ''.join(pieces)
+
+
+def _text(value, encoding):
+    if isinstance(value, str):
+        return value.decode(encoding, 'replace')
+    return value
@@ -0,0 +1,196 @@
+'''
+Run the stages of a job concurrently, connected by bounded queues.
+
+    pipe = Pipeline(maxsize=16)
+    docs = pipe.source('split', iter_docs())
+    docs = pipe.map('dump', dump, docs)
+    xmls = pipe.map('annotate', annotate, docs, threads=4)
+    for xml in pipe.results(xmls):
+        ...
+
+Every stage runs in a thread of its own and blocks when the queue to the
+next stage is full, so a slow stage holds back the stages before it
+instead of letting work pile up in memory, and the total run time
+approaches that of the slowest stage. Map stages that run several items at
+once (threads > 1, or a process pool) still pass them on in input order,
+with at most maxsize items in flight. If a stage raises, all stages stop
+and results() re-raises the exception.
+'''
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty, Full
+
+_end = object()
+_poll_interval = 0.1
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Pipeline(object):
+
+    def __init__(self, maxsize=16, stats=None):
+        '''
+        maxsize: capacity of the queues between stages.
+        stats: instrument.Stats that records the time each stage spends
+        on its items.
+        '''
+        self.maxsize = maxsize
+        self.stats = stats
+        self._stopping = threading.Event()
+        self._error = None
+        self._threads = []
+
+    def source(self, name, items):
+        '''
+        A stage that feeds the items of an iterable into the pipeline
+        '''
+        def run(_):
+            items_iter = iter(items)
+            while True:
+                with self._timer(name):
+                    item = next(items_iter, _end)
+                if item is _end:
+                    return
+                yield item
+        return self.stage(name, run, None)
+
+    def map(self, name, func, queue, threads=1, pool=None):
+        '''
+        A stage that yields func(item) for each item of queue, in order,
+        dropping None results. func runs in threads threads, or in pool
+        (e.g. a multiprocessing.Pool, in which case func must be
+        picklable) if given.
+        '''
+        def timed(item):
+            with self._timer(name):
+                return func(item)
+
+        def run(items):
+            if pool is None and threads == 1:
+                results = (timed(item) for item in items)
+                own_pool = None
+            else:
+                own_pool = ThreadPool(threads) if pool is None else None
+                results = self._imap(own_pool or pool,
+                                     timed if pool is None else func, items)
+            try:
+                for result in results:
+                    if result is not None:
+                        yield result
+            finally:
+                if own_pool is not None:
+                    own_pool.terminate()
+        return self.stage(name, run, queue)
+
+    def stage(self, name, func, queue):
+        '''
+        A stage that runs the generator function func over the items of
+        queue (None for a source) and passes on what it yields, e.g. to
+        group items into batches.
+        '''
+        out = Queue(self.maxsize)
+
+        def run():
+            items = self._items(queue) if queue is not None else None
+            results = func(items)
+            try:
+                for result in results:
+                    self._put(out, result)
+                self._put(out, _end)
+            except _Stopped:
+                pass
+            except:
+                self._fail(sys.exc_info())
+            finally:
+                # Run the generator's cleanup (e.g. terminating a pool)
+                # before the pipeline reports that the stage is done
+                results.close()
+
+        thread = threading.Thread(target=run, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+        return out
+
+    def results(self, queue):
+        '''
+        Yield the items that reach the end of the pipeline and wait for
+        all stages to finish
+        '''
+        try:
+            for item in self._items(queue):
+                yield item
+        except _Stopped:
+            pass
+        finally:
+            self._stopping.set()
+            for thread in self._threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def _fail(self, exc_info):
+        if self._error is None:
+            self._error = exc_info
+        self._stopping.set()
+
+    def _put(self, queue, item):
+        while True:
+            try:
+                queue.put(item, timeout=_poll_interval)
+                return
+            except Full:
+                if self._stopping.is_set():
+                    raise _Stopped()
+
+    def _items(self, queue):
+        while True:
+            try:
+                item = queue.get(timeout=_poll_interval)
+            except Empty:
+                if self._stopping.is_set():
+                    raise _Stopped()
+                continue
+            if item is _end:
+                return
+            yield item
+
+    def _imap(self, pool, func, items):
+        '''
+        pool.imap(func, items) with at most maxsize items submitted and
+        not yet consumed. pool.imap reads its input as fast as it can, so
+        without the limit it would empty the queue before this stage.
+        '''
+        slots = Queue(self.maxsize)
+
+        def feed():
+            try:
+                for item in items:
+                    self._put(slots, None)
+                    yield item
+            except _Stopped:
+                pass
+
+        for result in pool.imap(func, feed()):
+            slots.get()
+            if self._stopping.is_set():
+                raise _Stopped()
+            yield result
+
+    def _timer(self, name):
+        if self.stats is None:
+            return _null_timer
+        return self.stats.timer(name)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_timer = _NullTimer()
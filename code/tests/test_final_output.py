@@ -0,0 +1,67 @@
+'''
+ArticleParser.final_output on synthetic CoreNLP output.
+
+    cd code && python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import corenlp
+from article_parser import ArticleParser
+from benchmarks import synthetic
+from corenlp import cache as corenlp_cache
+
+
+class FinalOutputCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.xml_files = []
+        for doc_id in (1, 2):
+            path = os.path.join(self.dir, '2008_1_%03d.txt.xml' % doc_id)
+            with open(path, 'wb') as handle:
+                handle.write(synthetic.corenlp_xml(n_sents=10, seed=doc_id))
+            self.xml_files.append(path)
+        self.docs = [{'year': '2008', 'debate_number': '1',
+                      'doc_id': str(doc_id), 'publication': 'P',
+                      'byline': 'B'} for doc_id in (1, 2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def final_output(self, name, **kwargs):
+        ap = ArticleParser(None, self.dir, None, None, None)
+        ap.docs = self.docs
+        output_file = os.path.join(self.dir, name)
+        ap.final_output(output_file, **kwargs)
+        with open(output_file, 'rb') as handle:
+            return handle.read()
+
+    def sidecars(self):
+        return [os.path.exists(corenlp_cache.sidecar_path(path))
+                for path in self.xml_files]
+
+    def test_no_cache_by_default(self):
+        self.final_output('out.csv')
+        self.assertEqual(self.sidecars(), [False, False])
+
+    def test_second_run_reads_sidecar(self):
+        first = self.final_output('first.csv', cache=True)
+        self.assertEqual(self.sidecars(), [True, True])
+
+        def parse_options(*args):
+            raise AssertionError('parsed the XML instead of the sidecar')
+
+        original = corenlp._parse_options
+        corenlp._parse_options = parse_options
+        try:
+            second = self.final_output('second.csv', cache=True)
+        finally:
+            corenlp._parse_options = original
+        self.assertEqual(second, first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+'''
+ArticleParser.load and iter_docs on synthetic LexisNexis exports.
+
+    cd code && python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from article_parser import ArticleParser
+from benchmarks import synthetic
+
+_exports = [('2012 presidential debate 1.txt', 2012),
+            ('2008 presidential debate 10.txt', 2008),
+            ('2008 presidential debate 2.txt', 2008)]
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for i, (filename, year) in enumerate(_exports):
+            with open(os.path.join(self.dir, filename), 'wb') as handle:
+                handle.write(synthetic.lexisnexis_export(
+                    n_docs=12, n_words=20, year=year, seed=i))
+        # Not an export
+        with open(os.path.join(self.dir, 'notes.txt'), 'w') as handle:
+            handle.write('notes\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def keys(self, docs):
+        return [(doc['year'], doc['debate_number'], doc['doc_id'])
+                for doc in docs]
+
+    def test_iter_docs_in_load_order(self):
+        for workers in (1, 2):
+            ap = ArticleParser(self.dir, None, None, None, None)
+            ap.load(workers=workers)
+            self.assertEqual(sorted(ap.load_errors), ['notes.txt'])
+            self.assertEqual(len(ap.docs), 36)
+
+            streamed = ArticleParser(self.dir, None, None, None, None)
+            self.assertEqual(self.keys(streamed.iter_docs()),
+                             self.keys(ap.docs))
+            self.assertEqual(sorted(streamed.load_errors), ['notes.txt'])
+
+    def test_load_order(self):
+        ap = ArticleParser(self.dir, None, None, None, None)
+        ap.load()
+        keys = [tuple(int(x) for x in key) for key in self.keys(ap.docs)]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(keys[0], (2008, 2, 1))
+        self.assertEqual(keys[12], (2008, 10, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
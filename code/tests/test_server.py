@@ -0,0 +1,139 @@
+'''
+corenlp.server against a fake CoreNLP server (corenlp.fakeserver) that
+returns canned XML and fails some of the requests.
+
+    cd code && python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import corenlp
+from corenlp import pack
+from corenlp import server
+from corenlp.fakeserver import FakeServer
+
+_texts = ['Obama said on Tuesday that taxes would rise .',
+          'McCain answered that they would not .',
+          'The debate went on until late .',
+          'Voters were not convinced by either candidate .',
+          'Both campaigns claimed victory .']
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fake = FakeServer(fail_every=3)
+        self.client = server.Client(self.fake.url, pool_size=3, retries=3,
+                                    backoff=0.01)
+        self.names = ['2008_1_%03d.txt' % (i + 1)
+                      for i in range(len(_texts))]
+
+    def tearDown(self):
+        self.client.close()
+        self.fake.close()
+        shutil.rmtree(self.dir)
+
+    def write_texts(self):
+        paths = []
+        for name, text in zip(self.names, _texts):
+            path = os.path.join(self.dir, name)
+            with open(path, 'w') as handle:
+                handle.write(text)
+            paths.append(path)
+        return paths
+
+    def assertAnnotates(self, xml, text):
+        doc = corenlp.Document(xml, parse=False, coref=False)
+        self.assertEqual([unicode(sent) for sent in doc.sents], [text])
+
+    def test_files2dir(self):
+        paths = self.write_texts()
+        out_dir = os.path.join(self.dir, 'out')
+        annotated = []
+        # An iterator, which files2dir must not consume twice
+        self.assertEqual(server.files2dir(iter(paths), out_dir,
+                                          client=self.client,
+                                          callback=annotated.append), [])
+        self.assertEqual(annotated, paths)
+        for name, text in zip(self.names, _texts):
+            self.assertAnnotates(os.path.join(out_dir, name + '.xml'), text)
+        self.assertTrue(self.fake.failures > 0)
+        self.assertEqual(self.fake.requests,
+                         len(_texts) + self.fake.failures)
+
+        # Everything is annotated already
+        requests = self.fake.requests
+        self.assertEqual(server.files2dir(paths, out_dir,
+                                          client=self.client), [])
+        self.assertEqual(self.fake.requests, requests)
+
+    def test_files2dir_own_client(self):
+        # The client's default backoff is too slow to retry in a test
+        self.fake.fail_every = 0
+        paths = self.write_texts()
+        out_dir = os.path.join(self.dir, 'out')
+        server.files2dir(paths, out_dir, url=self.fake.url)
+        self.assertEqual(sorted(os.listdir(out_dir)),
+                         [name + '.xml' for name in self.names])
+
+    def test_files2dir_gives_up(self):
+        self.fake.fail_every = 1
+        client = server.Client(self.fake.url, pool_size=1, retries=2,
+                               backoff=0.01)
+        out_dir = os.path.join(self.dir, 'out')
+        paths = self.write_texts()
+        try:
+            failed = server.files2dir(paths, out_dir, client=client)
+        finally:
+            client.close()
+        # Every text was tried three times, and nothing was written
+        self.assertEqual(failed, paths)
+        self.assertEqual(self.fake.requests, 3 * len(paths))
+        self.assertEqual(os.listdir(out_dir), [])
+
+    def test_annotate_many_reads_ahead_boundedly(self):
+        read = []
+
+        def texts():
+            for i in range(100):
+                read.append(i)
+                yield 'text %d' % i
+
+        xmls = self.client.annotate_many(texts())
+        try:
+            next(xmls)
+            self.assertTrue(len(read) <= 2 * self.client.pool_size + 1)
+        finally:
+            xmls.close()
+
+    def test_pack2pack(self):
+        text_pack = os.path.join(self.dir, 'texts.pack')
+        out_pack = os.path.join(self.dir, 'annotations.pack')
+        with pack.PackWriter(text_pack) as texts:
+            for name, text in zip(self.names, _texts):
+                texts.add(name, text)
+
+        self.assertEqual(server.pack2pack(text_pack, out_pack,
+                                          client=self.client), [])
+        out = pack.PackReader(out_pack)
+        try:
+            self.assertEqual(out.names(),
+                             [name + '.xml' for name in self.names])
+            for name, text in zip(self.names, _texts):
+                self.assertAnnotates(out.open(name + '.xml'), text)
+        finally:
+            out.close()
+        self.assertTrue(self.fake.failures > 0)
+
+        # Everything is annotated already
+        requests = self.fake.requests
+        self.assertEqual(server.pack2pack(text_pack, out_pack,
+                                          client=self.client), [])
+        self.assertEqual(self.fake.requests, requests)
+
+
+if __name__ == '__main__':
+    unittest.main()